@@ -0,0 +1,227 @@
+"""Calls to the BigQuery API with retries, rate limiting and coalescing
+
+All API calls of the REPL and its background threads go through one `ApiClient`,
+so that they share a single rate limit and their retries are counted in one
+place.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+
+import requests
+from google.api_core import exceptions
+from google.auth.exceptions import GoogleAuthError
+
+from bqrepl.config import default_settings
+
+# errors after which making the same call again may succeed
+transient_errors = (
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    exceptions.TooManyRequests,
+    # raised by the HTTP transport, not subclasses of the builtin ones
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+# errors an API call may end with, as opposed to bugs
+api_errors = (exceptions.GoogleAPIError, GoogleAuthError, OSError, ValueError)
+
+max_backoff = 32.0
+
+
+def listed(method):
+    """Wraps a client method returning an iterator to read all of its pages"""
+    return lambda *args, **kwargs: list(method(*args, **kwargs))
+
+
+def error_messages(e):
+    """Messages of an API error, `errors` of Google errors or plain args"""
+    return getattr(e, "errors", None) or e.args or [str(e)]
+
+
+def existing_job(client, job_id, conflict, location=None):
+    """Job whose submission failed with `conflict`, as it had been created before
+
+    Jobs outside the US and EU multi-regions are only found with their location,
+    taken from the error (`Already Exists: Job project:location.job_id`) unless
+    given.
+    """
+    if location is None:
+        match = re.search(r":([\w-]+)\." + re.escape(job_id), str(conflict))
+        location = match.group(1) if match else None
+    return client.get_job(job_id, location=location)
+
+
+class ApiRows:
+    """Rows of a query result, with pages read through an `ApiClient`
+
+    A failed page ends the page generator of the row iterator, so after a
+    transient error the pages continue from a new iterator returned by
+    `resume(start_index)`, e.g. `job.result(start_index=start_index)`.
+    Other attributes are those of the row iterator, e.g. `to_arrow`.
+    """
+
+    def __init__(self, api, rows, resume):
+        self.api = api
+        self.rows = rows
+        self.resume = resume
+
+    def __getattr__(self, name):
+        return getattr(self.rows, name)
+
+    @property
+    def pages(self):
+        state = dict(pages=iter(self.rows.pages), read=0)
+
+        def fetch_page():
+            if state["pages"] is None:
+                state["pages"] = iter(self.resume(state["read"]).pages)
+            try:
+                return list(next(state["pages"]))
+            except StopIteration:
+                return None
+            except BaseException:
+                state["pages"] = None
+                raise
+
+        while True:
+            page = self.api.call("page", fetch_page)
+            if page is None:
+                return
+            state["read"] += len(page)
+            yield page
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class TokenBucket:
+    """Lets through `rate` calls per second on average, in bursts of up to `rate`
+
+    A rate of 0 lets everything through.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, sleep=time.sleep):
+        """Takes a token, waiting for one if needed, returns seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return waited
+                now = time.monotonic()
+                self._tokens = min(
+                    self.rate, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            sleep(delay)
+            waited += delay
+
+
+class ApiClient:
+    """Makes API calls with jittered exponential backoff on transient errors
+
+    Every call waits for a token of the rate limiter shared by all threads.
+    Identical calls marked with `coalesce` wait for the one already in flight
+    instead of making their own.
+
+    settings: dict with `api_retries`, `api_backoff_ms` and `api_rate_limit`,
+        read on every call so changes apply right away
+    """
+
+    def __init__(self, settings=None, sleep=time.sleep):
+        self.settings = settings if settings is not None else dict(default_settings)
+        self.sleep = sleep
+        self.bucket = TokenBucket(self.settings["api_rate_limit"])
+        # method -> calls, retries, failures, coalesced, throttled, waits in ms
+        self.counters = defaultdict(Counter)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _count(self, method, **counts):
+        with self._lock:
+            self.counters[method].update(counts)
+
+    def call(self, method, fn, *args, coalesce=False, retry_if=None, **kwargs):
+        """Returns `fn(*args, **kwargs)`, `method` names the call in counters
+
+        retry_if: callable getting a transient error, False if making the call
+            again won't help
+        """
+        if not coalesce:
+            return self._call(method, fn, args, kwargs, retry_if)
+
+        key = (method, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters[method]["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._call(method, fn, args, kwargs, retry_if)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def backoff(self, method, attempt):
+        """Waits before retry number `attempt` (from 0) of `method`"""
+        # full jitter, so that threads failing together don't retry together
+        backoff = self.settings["api_backoff_ms"] / 1000 * 2 ** attempt
+        delay = random.uniform(0, min(max_backoff, backoff))
+        self._count(method, retries=1, backoff_ms=round(delay * 1000))
+        self.sleep(delay)
+
+    def _call(self, method, fn, args, kwargs, retry_if):
+        attempt = 0
+        while True:
+            self.bucket.rate = self.settings["api_rate_limit"]
+            waited = self.bucket.acquire(self.sleep)
+            if waited:
+                self._count(method, throttled=1, throttle_ms=round(waited * 1000))
+            self._count(method, calls=1)
+            try:
+                return fn(*args, **kwargs)
+            except transient_errors as e:
+                if attempt >= self.settings["api_retries"] or (
+                    retry_if is not None and not retry_if(e)
+                ):
+                    self._count(method, failures=1)
+                    raise
+            except BaseException:
+                self._count(method, failures=1)
+                raise
+            self.backoff(method, attempt)
+            attempt += 1
+
+    def stats(self):
+        """Snapshot of the counters: {method: Counter}"""
+        with self._lock:
+            return {k: Counter(v) for k, v in self.counters.items()}
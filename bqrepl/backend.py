@@ -0,0 +1,10 @@
+from google.cloud import bigquery
+
+
+class BigQueryBackend:
+    """Creates clients talking to the real BigQuery API"""
+
+    requires_credentials = True
+
+    def client(self, project=None, credentials=None):
+        return bigquery.Client(project=project, credentials=credentials)
@@ -0,0 +1,145 @@
+"""Replays a workload of SQL statements concurrently and reports latencies"""
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+weight_re = re.compile(r"^\s*--\s*weight\s*[:=]\s*([\d.]+)\s*$", re.IGNORECASE)
+
+
+def load_workload(path):
+    """Reads statements separated by `;`, each with an optional weight
+
+    A `-- weight: N` comment in a statement sets its weight, default is 1.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+
+    workload = []
+    for statement in text.split(";"):
+        weight = 1.0
+        lines = []
+        for line in statement.splitlines():
+            match = weight_re.match(line)
+            if match:
+                weight = float(match.group(1))
+            else:
+                lines.append(line)
+        sql = "\n".join(lines).strip()
+        if sql:
+            workload.append((sql, weight))
+    return workload
+
+
+def percentile(values, p):
+    """`p`-th percentile of values, interpolating between closest ranks"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def run_query(client, sql):
+    """Runs query and reads all of its results, returns job statistics"""
+    job = client.query(sql)
+    rows = 0
+    for page in job.result().pages:
+        rows += len(list(page))
+    return dict(
+        rows=rows,
+        bytes_processed=job.total_bytes_processed or 0,
+        bytes_billed=job.total_bytes_billed or 0,
+        slot_ms=job.slot_millis or 0,
+        cache_hit=bool(job.cache_hit),
+    )
+
+
+def run_benchmark(
+    client_factory, workload, queries=100, concurrency=4, qps=None, seed=0
+):
+    """Replays `queries` statements picked from the weighted `workload`
+
+    Statements are run by `concurrency` workers, each with its own client from
+    `client_factory`. Without `qps` the next statement starts as soon as a worker
+    is free, otherwise they're submitted at the given rate and wait in a queue
+    when all workers are busy.
+
+    Returns one record per statement, with latency and time spent queued.
+    """
+    rng = random.Random(seed)
+    statements = rng.choices(
+        [sql for sql, weight in workload], [weight for sql, weight in workload],
+        k=queries,
+    )
+    local = threading.local()
+
+    def run(sql, submitted):
+        started = time.monotonic()
+        if not hasattr(local, "client"):
+            local.client = client_factory()
+        record = dict(sql=sql, queue_time=started - submitted, error=None)
+        try:
+            record.update(run_query(local.client, sql))
+        except Exception as e:
+            record["error"] = str(e)
+        record["latency"] = time.monotonic() - started
+        return record
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        for i, sql in enumerate(statements):
+            if qps:
+                delay = t0 + i / qps - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                submitted = time.monotonic()
+            else:
+                # closed loop, queue time is the wait for a free worker
+                submitted = t0
+            futures.append(pool.submit(run, sql, submitted))
+        records = [f.result() for f in futures]
+
+    return records, time.monotonic() - t0
+
+
+def summarize(records, wall_time):
+    """Latency percentiles and totals of benchmark records"""
+
+    def stats(values):
+        return dict(
+            p50=percentile(values, 50),
+            p95=percentile(values, 95),
+            p99=percentile(values, 99),
+            mean=sum(values) / len(values) if values else None,
+            max=max(values) if values else None,
+        )
+
+    ok = [r for r in records if r["error"] is None]
+    per_query = {}
+    for sql in dict.fromkeys(r["sql"] for r in records):
+        runs = [r for r in records if r["sql"] == sql]
+        per_query[sql] = dict(
+            count=len(runs),
+            errors=sum(r["error"] is not None for r in runs),
+            latency=stats([r["latency"] for r in runs if r["error"] is None]),
+            bytes_processed=sum(r.get("bytes_processed", 0) for r in runs),
+        )
+
+    return dict(
+        queries=len(records),
+        errors=len(records) - len(ok),
+        wall_time=wall_time,
+        qps=len(records) / wall_time if wall_time else None,
+        latency=stats([r["latency"] for r in ok]),
+        queue_time=stats([r["queue_time"] for r in records]),
+        bytes_processed=sum(r["bytes_processed"] for r in ok),
+        bytes_billed=sum(r["bytes_billed"] for r in ok),
+        slot_ms=sum(r["slot_ms"] for r in ok),
+        cache_hits=sum(r["cache_hit"] for r in ok),
+        per_query=per_query,
+    )
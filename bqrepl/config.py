@@ -2,9 +2,28 @@ default_settings = {
     "expanded": False,
     "format_integer": ",d",
     "format_float": ",.4f",
+    "format_numeric": "default",
+    "format_timestamp": "iso",
+    "format_datetime": "iso",
+    "format_date": "iso",
+    "format_bytes": "base64",
     "maxrows": 100,
     "maxwidth": 50,
     "max_expanded_width": 100,
+    "prefetch_pages": 1,
+    "fanout_workers": 8,
+    "display_budget_ms": 0,
+    "color": "auto",
+    "preview_prefetch": 0,
+    "metadata_refresh_interval": 0,
+    "metadata_refresh_budget": 30,
+    "expanded_columns": "",
+    "select_star_threshold_mb": 0,
+    "load_chunk_mb": 64,
+    "load_workers": 4,
+    "api_retries": 5,
+    "api_backoff_ms": 250,
+    "api_rate_limit": 20,
 }
 
 help_commands = [
@@ -29,8 +48,41 @@ help_commands = [
         "List columns in a table"
     ),
     (
-        r"\x, \expanded",
-        "Toggle expanded view on/off. Shorthand for \\set expanded BOOL"
+        r"\preview [PROJECT.]DATASET.TABLE[$PARTITION] [N] [COLUMN,...]",
+        "Show first N rows of a table without running a (billed) query"
+    ),
+    (
+        r"\stats [last|N|api]",
+        "Statistics and query plan stages of the last query, or stats of last N. "
+        "api shows API calls, retries and rate limit waits"
+    ),
+    (
+        r"\jobs [history [N]|next]",
+        "List N recent jobs in the project (default=20), next shows the next page"
+    ),
+    (
+        r"\fanout PROJECT[,PROJECT...] QUERY",
+        "Run query in all listed projects at once and combine the results. "
+        "Also available as \\foreach project in (PROJECT, ...) QUERY"
+    ),
+    (
+        r"\load FILE|GLOB [PROJECT.]DATASET.TABLE [COLUMN:TYPE,...]",
+        "Append rows of local CSV (with header), JSONL or Parquet files to a table, "
+        "uploaded in parallel chunks. Schema is detected unless given. "
+        "Running a failed load again skips chunks it loaded"
+    ),
+    (
+        r"\refresh",
+        "Drop cached tables metadata and previews"
+    ),
+    (
+        r"\more",
+        "Show more rows of results that were still loading"
+    ),
+    (
+        r"\x, \expanded [cols=PATTERN,...]",
+        "Toggle expanded view on/off. Shorthand for \\set expanded BOOL. "
+        "With cols= turns it on showing only columns matching the patterns"
     ),
     (
         r"\clear, clear",
@@ -45,7 +97,12 @@ help_options = [
     ),
     (
         r"\set maxrows INT",
-        "Maximum rows displayed (default=100)"
+        "Maximum rows displayed, auto to fit the terminal (default=100)"
+    ),
+    (
+        r"\set display_budget_ms INT",
+        "Show rows loaded within this many milliseconds and keep loading the "
+        "rest in the background, 0 to disable (default=0)"
     ),
     (
         r"\set maxwidth INT",
@@ -53,12 +110,64 @@ help_options = [
     ),
     (
         r"\set max_expanded_width INT",
-        "Maximum column width in expanded view (default=100)"
+        "Width at which values wrap in expanded view (default=100)"
+    ),
+    (
+        r"\set prefetch_pages INT",
+        "Result pages fetched ahead while rendering, 0 to disable (default=1)"
+    ),
+    (
+        r"\set preview_prefetch INT",
+        "Tables listed by \\t previewed in the background (default=0)"
+    ),
+    (
+        r"\set metadata_refresh_interval INT",
+        "Seconds between checks for changed tables, cached metadata is dropped "
+        "when they change. Every check runs a __TABLES__ query job per dataset, "
+        "hidden from \\jobs. 0 disables caching (default=0)"
+    ),
+    (
+        r"\set metadata_refresh_budget INT",
+        "Maximum query jobs per minute made checking for changes, one per dataset "
+        "(default=30)"
+    ),
+    (
+        r"\set select_star_threshold_mb INT",
+        "Offer to project displayed columns or filter partitions when running "
+        "SELECT * on tables bigger than this, 0 to disable (default=0)"
+    ),
+    (
+        r"\set load_chunk_mb INT",
+        "Size of file chunks uploaded by \\load with separate load jobs (default=64)"
+    ),
+    (
+        r"\set load_workers INT",
+        "Chunks uploaded by \\load at once (default=4)"
+    ),
+    (
+        r"\set api_retries INT",
+        "API calls retried after transient (429, 5xx) errors (default=5)"
+    ),
+    (
+        r"\set api_backoff_ms INT",
+        "Base of the jittered exponential backoff between retries (default=250)"
+    ),
+    (
+        r"\set api_rate_limit INT",
+        "API calls per second across all threads, 0 for no limit (default=20)"
+    ),
+    (
+        r"\set fanout_workers INT",
+        "Maximum projects queried at once by \\fanout (default=8)"
     ),
     (
         r"\set expanded BOOL",
         "Expanded view (default=False)"
     ),
+    (
+        r"\set color auto|on|off",
+        "Colored output, auto colors only when writing to a terminal (default=auto)"
+    ),
     (
         r"\set format_integer STR",
         "Integer display format (default=',d')"
@@ -67,4 +176,24 @@ help_options = [
         r"\set format_float STR",
         "Float display format (default=',.4f')"
     ),
+    (
+        r"\set format_numeric STR",
+        "NUMERIC/BIGNUMERIC display format, e.g. ',.2f' (default='default')"
+    ),
+    (
+        r"\set format_timestamp STR",
+        "TIMESTAMP display format, strftime pattern or 'iso' (default='iso')"
+    ),
+    (
+        r"\set format_datetime STR",
+        "DATETIME display format, strftime pattern or 'iso' (default='iso')"
+    ),
+    (
+        r"\set format_date STR",
+        "DATE display format, strftime pattern or 'iso' (default='iso')"
+    ),
+    (
+        r"\set format_bytes hex|base64",
+        "BYTES display encoding (default='base64')"
+    ),
 ]
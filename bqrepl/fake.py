@@ -0,0 +1,806 @@
+"""In-process fake of the BigQuery API
+
+Serves configurable tables with synthetic rows, paging, injected latency and
+errors, so that bqrepl can be tested and benchmarked without network access.
+Only the parts of `bigquery.Client` used by bqrepl are implemented.
+"""
+import copy
+import csv
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytz
+from google.api_core import exceptions
+from google.cloud import bigquery
+from google.cloud.bigquery.client import Project
+from google.cloud.bigquery.dataset import DatasetListItem
+from google.cloud.bigquery.job import QueryPlanEntry
+from google.cloud.bigquery.table import Row, TableListItem
+
+# rough storage size of a single value, used for byte estimates
+type_sizes = {
+    "INTEGER": 8,
+    "INT64": 8,
+    "FLOAT": 8,
+    "FLOAT64": 8,
+    "NUMERIC": 16,
+    "BIGNUMERIC": 32,
+    "BOOLEAN": 1,
+    "BOOL": 1,
+    "STRING": 16,
+    "BYTES": 16,
+    "TIMESTAMP": 8,
+    "DATETIME": 8,
+    "DATE": 8,
+}
+
+epoch = datetime(2021, 1, 1, tzinfo=pytz.utc)
+
+tables_re = re.compile(
+    r"\bfrom\s+`?(?P<dataset>[\w\-]+\.[\w\-]+)\.__TABLES__`?", re.IGNORECASE
+)
+
+ddl_re = re.compile(
+    r"^\s*(?P<op>alter|drop)\s+table\s+`?(?P<table>[\w\-.]+)`?"
+    r"(?:\s+add\s+column\s+(?P<column>\w+)\s+(?P<type>\w+))?\s*;?\s*$",
+    re.IGNORECASE,
+)
+
+query_re = re.compile(
+    r"^\s*select\s+(?P<columns>.+?)\s+from\s+`?(?P<table>[\w\-.$]+)`?"
+    r"(?:\s+where\s+(?P<where>.+?))?"
+    r"(?:\s+limit\s+(?P<limit>\d+))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def to_millis(dt):
+    return str(int(dt.timestamp() * 1000))
+
+
+def synthetic_value(field_type, name, rng, i):
+    """Deterministic value of the given type for row `i`"""
+    if field_type in ("INTEGER", "INT64"):
+        return rng.randint(-1_000_000, 1_000_000)
+    if field_type in ("FLOAT", "FLOAT64"):
+        return rng.uniform(-1_000_000, 1_000_000)
+    if field_type in ("NUMERIC", "BIGNUMERIC"):
+        return Decimal(rng.randint(-10 ** 12, 10 ** 12)).scaleb(-9)
+    if field_type in ("BOOLEAN", "BOOL"):
+        return rng.random() < 0.5
+    if field_type == "BYTES":
+        return bytes(rng.getrandbits(8) for _ in range(16))
+    if field_type == "TIMESTAMP":
+        return epoch + timedelta(seconds=rng.randint(0, 365 * 86400))
+    if field_type == "DATETIME":
+        return epoch.replace(tzinfo=None) + timedelta(
+            seconds=rng.randint(0, 365 * 86400)
+        )
+    if field_type == "DATE":
+        return date(2021, 1, 1) + timedelta(days=rng.randint(0, 364))
+    return f"{name}_{i}"
+
+
+class FakeTable:
+    """Table metadata along with its rows, explicit or generated on demand"""
+
+    def __init__(self, table, rows=None, num_rows=0, seed=0, partitions=1):
+        self.table = table
+        self.rows = rows
+        self.num_rows = len(rows) if rows is not None else num_rows
+        self.seed = seed
+        self.partitions = partitions
+
+    @property
+    def schema(self):
+        return self.table.schema
+
+    def row(self, i):
+        if self.rows is not None:
+            row = self.rows[i]
+            if isinstance(row, dict):
+                return tuple(row.get(f.name) for f in self.schema)
+            return tuple(row)
+        rng = random.Random(self.seed * 1_000_003 + i)
+        return tuple(
+            synthetic_value(f.field_type, f.name, rng, i) for f in self.schema
+        )
+
+    def bytes_per_row(self, columns=None):
+        return sum(
+            type_sizes.get(f.field_type, 16)
+            for f in self.schema
+            if columns is None or f.name in columns
+        )
+
+
+class FakeBackend:
+    """Shared state of the fake BigQuery, hands out `FakeClient`s
+
+    latency: seconds slept in every API call
+    page_latency: seconds slept for every page of results
+    query_latency: seconds a query job takes to finish
+    """
+
+    requires_credentials = False
+
+    def __init__(
+        self, latency=0.0, page_latency=0.0, query_latency=0.0, page_size=1000,
+        auto_create=False,
+    ):
+        self.latency = latency
+        self.page_latency = page_latency
+        self.query_latency = query_latency
+        self.page_size = page_size
+        self.auto_create = auto_create
+        self.projects = {}
+        self.datasets = {}
+        self.tables = {}
+        self.query_results = []
+        self.jobs = []
+        # job id -> job, of query and load jobs alike
+        self.job_ids = {}
+        self.calls = Counter()
+        self.failures = defaultdict(list)
+        self.lock = threading.RLock()
+        self._version = 0
+
+    def client(self, project=None, credentials=None):
+        return FakeClient(self, project)
+
+    def _touch(self, props):
+        with self.lock:
+            self._version += 1
+            props["etag"] = f"etag-{self._version}"
+            props["lastModifiedTime"] = to_millis(
+                datetime.now(tz=pytz.utc) + timedelta(milliseconds=self._version)
+            )
+
+    def add_project(self, project, friendly_name=None):
+        with self.lock:
+            self.projects.setdefault(project, friendly_name or project)
+
+    def add_dataset(self, dataset_id, location="US"):
+        project, dataset = dataset_id.split(".")
+        self.add_project(project)
+        with self.lock:
+            if dataset_id not in self.datasets:
+                ds = bigquery.Dataset(dataset_id)
+                ds._properties["location"] = location
+                ds._properties["creationTime"] = to_millis(datetime.now(tz=pytz.utc))
+                self._touch(ds._properties)
+                self.datasets[dataset_id] = ds
+            return self.datasets[dataset_id]
+
+    def add_table(
+        self, table_id, schema, rows=None, num_rows=0, seed=0,
+        partition_field=None, partitions=30,
+    ):
+        """Registers a table with explicit `rows` or `num_rows` synthetic rows
+
+        schema: list of `SchemaField`s or (name, type) tuples
+        """
+        schema = [
+            f if isinstance(f, bigquery.SchemaField) else bigquery.SchemaField(*f)
+            for f in schema
+        ]
+        self.add_dataset(".".join(table_id.split(".")[:2]))
+        table = bigquery.Table(table_id, schema=schema)
+        table._properties["type"] = "TABLE"
+        table._properties["creationTime"] = to_millis(datetime.now(tz=pytz.utc))
+        if partition_field:
+            table.time_partitioning = bigquery.TimePartitioning(field=partition_field)
+        fake = FakeTable(
+            table, rows=rows, num_rows=num_rows, seed=seed,
+            partitions=partitions if partition_field else 1,
+        )
+        table._properties["numRows"] = str(fake.num_rows)
+        table._properties["numBytes"] = str(fake.num_rows * fake.bytes_per_row())
+        self._touch(table._properties)
+        with self.lock:
+            self.tables[table_id] = fake
+        return table
+
+    def alter_table(self, table_id, schema=None, rows=None, num_rows=None):
+        """Changes an existing table the way a DDL/DML statement would"""
+        with self.lock:
+            fake = self.tables[table_id]
+            partitioning = fake.table.time_partitioning
+            return self.add_table(
+                table_id,
+                schema if schema is not None else fake.schema,
+                rows=rows if rows is not None else fake.rows,
+                num_rows=num_rows if num_rows is not None else fake.num_rows,
+                seed=fake.seed,
+                partition_field=partitioning.field if partitioning else None,
+                partitions=fake.partitions,
+            )
+
+    def drop_table(self, table_id):
+        with self.lock:
+            del self.tables[table_id]
+
+    def add_query_result(self, pattern, schema, rows):
+        """Serves `rows` for queries matching the `pattern` regex"""
+        self.query_results.append(
+            (re.compile(pattern, re.IGNORECASE | re.DOTALL), schema, rows)
+        )
+
+    def fail(self, method, error, times=1):
+        """Makes the next `times` calls of `method` raise `error`"""
+        with self.lock:
+            self.failures[method].extend([error] * times)
+
+    def call(self, method, latency=None):
+        """Accounts for an API call: counts it, waits and raises injected errors"""
+        with self.lock:
+            self.calls[method] += 1
+            error = self.failures[method].pop(0) if self.failures[method] else None
+        latency = self.latency if latency is None else latency
+        if latency:
+            time.sleep(latency)
+        if error is not None:
+            raise error
+
+    def page(self):
+        self.call("page", latency=self.page_latency)
+
+
+class FakePageIterator:
+    """Pages through `count` items produced by `item(i)`
+
+    Iteration starts at `start` and ends after `max_results` items, page tokens
+    are indexes of the next item.
+    """
+
+    def __init__(
+        self, backend, item, count, page_size=None, start=0, max_results=None
+    ):
+        self._backend = backend
+        self._item = item
+        self._start = start
+        self._count = count
+        self._stop = count if max_results is None else min(count, start + max_results)
+        self._page_size = page_size or backend.page_size
+        self.next_page_token = None
+
+    @property
+    def pages(self):
+        for start in range(self._start, self._stop, self._page_size):
+            self._backend.page()
+            stop = min(start + self._page_size, self._stop)
+            self.next_page_token = str(stop) if stop < self._count else None
+            yield [self._item(i) for i in range(start, stop)]
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class FakeRowIterator(FakePageIterator):
+    def __init__(self, backend, table, schema, max_results=None, **kwargs):
+        names = [f.name for f in table.schema]
+        index = [names.index(f.name) for f in schema]
+        field_to_index = {f.name: i for i, f in enumerate(schema)}
+
+        def item(i):
+            values = table.row(i)
+            return Row(tuple(values[j] for j in index), field_to_index)
+
+        super().__init__(
+            backend, item, table.num_rows, max_results=max_results, **kwargs
+        )
+        self.schema = schema
+        self.total_rows = self._stop - self._start
+
+    def to_arrow_iterable(self, bqstorage_client=None, max_queue_size=None):
+        import pyarrow
+
+        names = [f.name for f in self.schema]
+        for page in self.pages:
+            columns = zip(*(row.values() for row in page))
+            yield pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(c) for c in columns], names=names
+            )
+
+    def to_arrow(self, progress_bar_type=None, bqstorage_client=None,
+                 create_bqstorage_client=True):
+        import pyarrow
+
+        batches = list(self.to_arrow_iterable())
+        if not batches:
+            return pyarrow.table({f.name: [] for f in self.schema})
+        return pyarrow.Table.from_batches(batches)
+
+    def to_dataframe(self, **kwargs):
+        return self.to_arrow().to_pandas()
+
+
+class FakeQueryJob:
+    def __init__(self, backend, project, query, table, schema,
+                 limit=None, bytes_processed=0, cache_hit=False, dry_run=False):
+        now = datetime.now(tz=pytz.utc)
+        self._backend = backend
+        self._table = table
+        self._limit = limit
+        self.job_id = str(uuid.uuid4())
+        self.job_type = "query"
+        self.project = project
+        self.location = "US"
+        self.query = query
+        self.user_email = "fake@example.com"
+        self.statement_type = "SELECT"
+        self.ddl_target_table = None
+        self.destination = None
+        self.referenced_tables = []
+        self.dry_run = dry_run
+        self.errors = None
+        self.error_result = None
+        self.state = "DONE" if dry_run else "RUNNING"
+        self._error = None
+        self.schema = schema or []
+        self.created = now
+        self.started = None if dry_run else now
+        self.ended = None if dry_run else now + timedelta(seconds=backend.query_latency)
+        self.cache_hit = cache_hit
+        self.total_bytes_processed = bytes_processed
+        if cache_hit or dry_run or not bytes_processed:
+            self.total_bytes_billed = 0
+        else:
+            mb = 1024 * 1024
+            self.total_bytes_billed = max(10 * mb, math.ceil(bytes_processed / mb) * mb)
+        rows = table.num_rows if table is not None else 1
+        self.slot_millis = 0 if (cache_hit or dry_run) else 10 + rows // 100
+        self.query_plan = [] if (cache_hit or dry_run) else self._plan(rows)
+
+    def _plan(self, rows):
+        rng = random.Random(self.query)
+        plan = []
+        for i, name in enumerate(("S00: Input", "S01: Aggregate", "S02: Output")):
+            ratios = [rng.random() for _ in range(4)]
+            top = max(ratios)
+            plan.append(QueryPlanEntry.from_api_repr({
+                "name": name,
+                "id": str(i),
+                "status": "COMPLETE",
+                "waitRatioAvg": ratios[0] / top / 2,
+                "waitRatioMax": ratios[0] / top,
+                "readRatioAvg": ratios[1] / top / 2,
+                "readRatioMax": ratios[1] / top,
+                "computeRatioAvg": ratios[2] / top / 2,
+                "computeRatioMax": ratios[2] / top,
+                "writeRatioAvg": ratios[3] / top / 2,
+                "writeRatioMax": ratios[3] / top,
+                "recordsRead": str(rows),
+                "recordsWritten": str(rows if i == 2 else max(1, rows // 10)),
+                "shuffleOutputBytes": str(rows * 8),
+                "shuffleOutputBytesSpilled": "0",
+                "slotMs": str(self.slot_millis // 3),
+            }))
+        return plan
+
+    def done(self):
+        return self.state == "DONE"
+
+    def result(
+        self, page_size=None, max_results=None, timeout=None, start_index=None
+    ):
+        # errors injected into "result" fail polling, the job keeps running,
+        # the ones injected into "job" make the job itself fail
+        self._backend.call("result")
+        if self.state != "DONE":
+            if self._backend.query_latency:
+                time.sleep(self._backend.query_latency)
+            try:
+                self._backend.call("job")
+            except exceptions.GoogleAPICallError as e:
+                self._error = e
+                self.error_result = {"reason": e.reason, "message": e.message}
+            self.state = "DONE"
+        if self._error is not None:
+            raise self._error
+        start_index = start_index or 0
+        if self._limit is not None:
+            limit = max(0, self._limit - start_index)
+            max_results = limit if max_results is None else min(max_results, limit)
+        return FakeRowIterator(
+            self._backend, self._table, self.schema, max_results=max_results,
+            page_size=page_size, start=start_index,
+        )
+
+
+class FakeLoadJob:
+    def __init__(
+        self, backend, project, destination, output_rows, job_id=None, location="US"
+    ):
+        self._backend = backend
+        self.job_id = job_id or str(uuid.uuid4())
+        self.job_type = "load"
+        self.project = project
+        self.location = location
+        self.destination = destination
+        self.output_rows = output_rows
+        self.errors = None
+        self.error_result = None
+        self.state = "DONE"
+
+    def done(self):
+        return True
+
+    def result(self, timeout=None):
+        self._backend.call("result")
+        return self
+
+
+def detect_type(values):
+    """Field type fitting all the (CSV or JSON) values"""
+    values = [v for v in values if v not in (None, "")]
+    for field_type, check in (
+        ("BOOLEAN", lambda v: str(v).lower() in ("true", "false")),
+        ("INTEGER", lambda v: re.fullmatch(r"-?\d+", str(v))),
+        ("FLOAT", lambda v: re.fullmatch(r"-?\d*\.?\d+(e-?\d+)?", str(v))),
+    ):
+        if values and all(check(v) for v in values):
+            return field_type
+    return "STRING"
+
+
+def convert(value, field_type):
+    """Loaded value in the type of the column"""
+    if value is None or value == "":
+        return None
+    if field_type in ("INTEGER", "INT64"):
+        return int(value)
+    if field_type in ("FLOAT", "FLOAT64"):
+        return float(value)
+    if field_type in ("BOOLEAN", "BOOL"):
+        return value if isinstance(value, bool) else value.lower() == "true"
+    return value
+
+
+def parse_load_data(data, config):
+    """Rows as dicts and their detected schema, from uploaded file content"""
+    fmt = config.source_format
+    if fmt == bigquery.SourceFormat.PARQUET:
+        import pyarrow.parquet
+
+        rows = pyarrow.parquet.read_table(io.BytesIO(data)).to_pylist()
+    elif fmt == bigquery.SourceFormat.NEWLINE_DELIMITED_JSON:
+        rows = [json.loads(line) for line in data.decode().splitlines() if line]
+    else:
+        lines = list(csv.reader(io.StringIO(data.decode())))
+        skip = config.skip_leading_rows or 0
+        if config.schema:
+            names = [f.name for f in config.schema]
+        elif skip:
+            names = lines[0]
+        else:
+            names = [f"string_field_{i}" for i in range(len(lines[0]))]
+        rows = [dict(zip(names, line)) for line in lines[skip:]]
+
+    names = list(dict.fromkeys(k for row in rows for k in row))
+    schema = [
+        bigquery.SchemaField(name, detect_type([row.get(name) for row in rows]))
+        for name in names
+    ]
+    return rows, schema
+
+
+class FakeClient:
+    def __init__(self, backend, project=None):
+        self._backend = backend
+        self.project = project
+        if project:
+            backend.add_project(project)
+
+    def _table_id(self, table):
+        if not isinstance(table, str):
+            return f"{table.project}.{table.dataset_id}.{table.table_id}"
+        parts = table.strip("`").split("$")[0].split(".")
+        if len(parts) == 2:
+            parts = [self.project] + parts
+        if len(parts) != 3:
+            raise ValueError(f"Invalid table reference {table}")
+        return ".".join(parts)
+
+    def _fake_table(self, table):
+        table_id = self._table_id(table)
+        try:
+            return self._backend.tables[table_id]
+        except KeyError:
+            raise exceptions.NotFound(f"Not found: Table {table_id}")
+
+    def close(self):
+        pass
+
+    def list_projects(self, max_results=None, page_token=None):
+        self._backend.call("list_projects")
+        return [
+            Project.from_api_repr({
+                "projectReference": {"projectId": p},
+                "id": p,
+                "numericId": str(i),
+                "friendlyName": name,
+            })
+            for i, (p, name) in enumerate(sorted(self._backend.projects.items()))
+        ]
+
+    def list_datasets(self, project=None, max_results=None, page_token=None):
+        self._backend.call("list_datasets")
+        project = project or self.project
+        return [
+            DatasetListItem(copy.deepcopy(ds._properties))
+            for ds_id, ds in sorted(self._backend.datasets.items())
+            if ds.project == project
+        ]
+
+    def get_dataset(self, dataset_ref):
+        self._backend.call("get_dataset")
+        if not isinstance(dataset_ref, str):
+            dataset_ref = f"{dataset_ref.project}.{dataset_ref.dataset_id}"
+        if len(dataset_ref.split(".")) == 1:
+            dataset_ref = f"{self.project}.{dataset_ref}"
+        try:
+            ds = self._backend.datasets[dataset_ref]
+        except KeyError:
+            raise exceptions.NotFound(f"Not found: Dataset {dataset_ref}")
+        return bigquery.Dataset.from_api_repr(copy.deepcopy(ds._properties))
+
+    def list_tables(self, dataset, max_results=None, page_token=None):
+        self._backend.call("list_tables")
+        if not isinstance(dataset, str):
+            dataset = f"{dataset.project}.{dataset.dataset_id}"
+        if len(dataset.split(".")) == 1:
+            dataset = f"{self.project}.{dataset}"
+        if dataset not in self._backend.datasets:
+            raise exceptions.NotFound(f"Not found: Dataset {dataset}")
+        return [
+            TableListItem(copy.deepcopy(t.table._properties))
+            for table_id, t in sorted(self._backend.tables.items())
+            if table_id.startswith(dataset + ".")
+        ]
+
+    def get_table(self, table):
+        self._backend.call("get_table")
+        fake = self._fake_table(table)
+        return bigquery.Table.from_api_repr(copy.deepcopy(fake.table._properties))
+
+    def list_rows(
+        self, table, selected_fields=None, max_results=None, page_token=None,
+        start_index=None, page_size=None, timeout=None,
+    ):
+        self._backend.call("list_rows")
+        fake = self._fake_table(table)
+        schema = fake.schema
+        if selected_fields:
+            names = [f.name for f in selected_fields]
+            schema = [f for f in fake.schema if f.name in names]
+        return FakeRowIterator(
+            self._backend, fake, schema, max_results=max_results,
+            page_size=page_size, start=start_index or 0,
+        )
+
+    def load_table_from_file(
+        self, file_obj, destination, rewind=False, size=None, job_config=None,
+        job_id=None, **kwargs
+    ):
+        self._backend.call("load_table_from_file")
+        self._check_job_id(job_id)
+        if rewind:
+            file_obj.seek(0)
+        data = file_obj.read() if size is None else file_obj.read(size)
+        table_id = self._table_id(destination)
+        try:
+            rows, schema = parse_load_data(data, job_config)
+        except (ValueError, IndexError) as e:
+            raise exceptions.BadRequest(f"Error while reading data: {e}")
+
+        with self._backend.lock:
+            fake = self._backend.tables.get(table_id)
+            if fake is None:
+                schema = job_config.schema or schema
+            else:
+                schema = fake.schema
+                existing = [fake.row(i) for i in range(fake.num_rows)]
+            try:
+                new = [
+                    tuple(convert(row.get(f.name), f.field_type) for f in schema)
+                    for row in rows
+                ]
+            except ValueError as e:
+                raise exceptions.BadRequest(f"Error while reading data: {e}")
+            if fake is None:
+                self._backend.add_table(table_id, schema, rows=new)
+            else:
+                self._backend.alter_table(table_id, rows=existing + new)
+            dataset = self._backend.datasets[table_id.rsplit(".", 1)[0]]
+            job = FakeLoadJob(
+                self._backend, self.project, table_id, len(new), job_id=job_id,
+                location=dataset.location,
+            )
+            self._backend.job_ids[job.job_id] = job
+        return job
+
+    def _check_job_id(self, job_id):
+        with self._backend.lock:
+            job = self._backend.job_ids.get(job_id)
+        if job is not None:
+            raise exceptions.Conflict(
+                f"Already Exists: Job {job.project}:{job.location}.{job_id}"
+            )
+
+    def get_job(self, job_id, project=None, location=None, **kwargs):
+        self._backend.call("get_job")
+        with self._backend.lock:
+            job = self._backend.job_ids.get(job_id)
+        # like jobs.get, only finds regional jobs given their location
+        if job is None or location != job.location and (
+            location or job.location not in ("US", "EU")
+        ):
+            raise exceptions.NotFound(f"Not found: Job {self.project}:{job_id}")
+        return job
+
+    def list_jobs(
+        self, project=None, max_results=None, page_token=None, all_users=None,
+        state_filter=None, page_size=None, **kwargs
+    ):
+        self._backend.call("list_jobs")
+        project = project or self.project
+        jobs = [j for j in reversed(self._backend.jobs) if j.project == project]
+        return FakePageIterator(
+            self._backend, jobs.__getitem__, len(jobs), page_size=page_size,
+            start=int(page_token or 0), max_results=max_results,
+        )
+
+    def query(
+        self, query, job_config=None, project=None, location=None, job_id=None,
+        job_id_prefix=None, **kwargs
+    ):
+        self._backend.call("query")
+        if job_id is None and job_id_prefix is not None:
+            job_id = job_id_prefix + str(uuid.uuid4())
+        self._check_job_id(job_id)
+        job = self._query(query, job_config, project or self.project)
+        job.location = location or job.location
+        if job_id is not None and not job.dry_run:
+            with self._backend.lock:
+                del self._backend.job_ids[job.job_id]
+                job.job_id = job_id
+                self._backend.job_ids[job_id] = job
+        return job
+
+    def _query(self, query, job_config, project):
+        dry_run = bool(job_config and job_config.dry_run)
+        use_cache = not (job_config and job_config.use_query_cache is False)
+
+        for pattern, schema, rows in self._backend.query_results:
+            if pattern.search(query):
+                schema = [
+                    f if isinstance(f, bigquery.SchemaField)
+                    else bigquery.SchemaField(*f)
+                    for f in schema
+                ]
+                table = FakeTable(bigquery.Table("_fake._fake._result", schema), rows)
+                return self._job(
+                    project, query, table, schema, None, 0, use_cache, dry_run
+                )
+
+        match = tables_re.search(query)
+        if match:
+            return self._tables_query(project, query, match.group("dataset"), dry_run)
+        match = ddl_re.match(query)
+        if match:
+            return self._ddl(project, query, match, dry_run)
+
+        match = query_re.match(query)
+        if not match:
+            if re.search(r"\bfrom\b", query, re.IGNORECASE):
+                raise exceptions.BadRequest(
+                    "Query not supported by the fake backend: " + query
+                )
+            schema = [bigquery.SchemaField("f0_", "INTEGER")]
+            table = FakeTable(bigquery.Table("_fake._fake._result", schema), [(1,)])
+            return self._job(project, query, table, schema, None, 0, use_cache, dry_run)
+
+        table_id = self._table_id(match.group("table"))
+        if table_id not in self._backend.tables and self._backend.auto_create:
+            self._backend.add_table(
+                table_id,
+                [("id", "INTEGER"), ("name", "STRING"), ("value", "FLOAT"),
+                 ("created", "TIMESTAMP")],
+                num_rows=1000,
+            )
+        fake = self._fake_table(table_id)
+        columns = [c.strip().strip("`") for c in match.group("columns").split(",")]
+        if columns == ["*"]:
+            schema = fake.schema
+        else:
+            names = [f.name for f in fake.schema]
+            for c in columns:
+                if c not in names:
+                    raise exceptions.BadRequest(f"Unrecognized name: {c}")
+            schema = [f for f in fake.schema if f.name in columns]
+
+        bytes_processed = fake.num_rows * fake.bytes_per_row([f.name for f in schema])
+        partition = fake.table.time_partitioning
+        where = match.group("where") or ""
+        if partition is not None and partition.field and re.search(
+            r"\b" + re.escape(partition.field) + r"\b", where
+        ):
+            bytes_processed //= fake.partitions
+        limit = int(match.group("limit")) if match.group("limit") else None
+        return self._job(
+            project, query, fake, schema, limit, bytes_processed, use_cache, dry_run
+        )
+
+    def _tables_query(self, project, query, dataset, dry_run):
+        """`__TABLES__` metadata of all tables in the dataset"""
+        dataset_id = self._table_id(dataset + ".x").rsplit(".", 1)[0]
+        if dataset_id not in self._backend.datasets:
+            raise exceptions.NotFound(f"Not found: Dataset {dataset_id}")
+        schema = [
+            bigquery.SchemaField("table_id", "STRING"),
+            bigquery.SchemaField("last_modified_time", "INTEGER"),
+            bigquery.SchemaField("row_count", "INTEGER"),
+        ]
+        with self._backend.lock:
+            rows = [
+                (table_id.rsplit(".", 1)[1],
+                 int(fake.table._properties["lastModifiedTime"]), fake.num_rows)
+                for table_id, fake in sorted(self._backend.tables.items())
+                if table_id.rsplit(".", 1)[0] == dataset_id
+            ]
+        table = FakeTable(bigquery.Table("_fake._fake._result", schema), rows)
+        return self._job(project, query, table, schema, None, 0, False, dry_run)
+
+    def _ddl(self, project, query, match, dry_run):
+        """ALTER TABLE ... ADD COLUMN and DROP TABLE statements"""
+        table_id = self._table_id(match.group("table"))
+        fake = self._fake_table(table_id)
+        op = match.group("op").upper()
+        if not dry_run:
+            if op == "DROP":
+                self._backend.drop_table(table_id)
+            elif match.group("column"):
+                rows = None
+                if fake.rows is not None:
+                    rows = [fake.row(i) + (None,) for i in range(fake.num_rows)]
+                self._backend.alter_table(table_id, rows=rows, schema=fake.schema + [
+                    bigquery.SchemaField(match.group("column"), match.group("type"))
+                ])
+        table = FakeTable(bigquery.Table("_fake._fake._result", []), [])
+        job = self._job(project, query, table, [], None, 0, False, dry_run)
+        job.statement_type = f"{op}_TABLE"
+        job.location = self._backend.datasets[table_id.rsplit(".", 1)[0]].location
+        job.ddl_target_table = bigquery.TableReference.from_string(table_id)
+        return job
+
+    def _job(self, project, query, table, schema, limit, bytes_processed,
+             use_cache, dry_run):
+        with self._backend.lock:
+            cache_hit = use_cache and not dry_run and any(
+                j.query == query and j.project == project for j in self._backend.jobs
+            )
+            job = FakeQueryJob(
+                self._backend, project, query, table=table, schema=schema,
+                limit=limit, bytes_processed=bytes_processed, cache_hit=cache_hit,
+                dry_run=dry_run,
+            )
+            # jobs run where the data is
+            dataset = self._backend.datasets.get(
+                f"{table.table.project}.{table.table.dataset_id}"
+            )
+            job.location = dataset.location if dataset else "US"
+            if not dry_run:
+                self._backend.jobs.append(job)
+                self._backend.job_ids[job.job_id] = job
+        return job
@@ -0,0 +1,156 @@
+"""Formatting of values by column type
+
+Every column gets its formatter closure once, built from the settings, instead
+of looking up the type and format for every value.
+"""
+import base64
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytz
+
+epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+# lines of `max_expanded_width` a BYTES value takes at most in the expanded view
+expanded_bytes_lines = 10
+
+# field type -> factory(settings) -> formatter(value) -> str
+formatters = {}
+
+# format setting -> field type and a value to try the format on
+format_samples = {
+    "format_integer": ("INTEGER", 1234),
+    "format_float": ("FLOAT", 1234.5),
+    "format_numeric": ("NUMERIC", Decimal("1234.5")),
+    "format_timestamp": ("TIMESTAMP", epoch),
+    "format_datetime": ("DATETIME", datetime(1970, 1, 1)),
+    "format_date": ("DATE", date(1970, 1, 1)),
+    "format_bytes": ("BYTES", b"bqrepl"),
+}
+
+
+def formatter(*field_types):
+    """Registers formatter factory for the field types"""
+
+    def register(factory):
+        for field_type in field_types:
+            formatters[field_type] = factory
+        return factory
+
+    return register
+
+
+def truncated(format_value, maxwidth):
+    """Wraps formatter to cut values longer than `maxwidth`, unless it's None"""
+    if maxwidth is None:
+        return format_value
+
+    def format_truncated(v):
+        formatted_value = format_value(v)
+        if len(formatted_value) > maxwidth:
+            return formatted_value[:maxwidth] + "..."
+        return formatted_value
+
+    return format_truncated
+
+
+def get_formatter(field_type, settings):
+    """Formatter for values of the field type"""
+    factory = formatters.get(field_type, string_formatter)
+    return factory(settings)
+
+
+def check_format(setting, value, settings):
+    """Raises ValueError if values can't be formatted with `value` as `setting`"""
+    if setting not in format_samples:
+        return
+    field_type, sample = format_samples[setting]
+    try:
+        get_formatter(field_type, dict(settings, **{setting: value}))(sample)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Can't format {field_type} values with {value!r}: {e}")
+
+
+@formatter("INTEGER", "INT64")
+def integer_formatter(settings):
+    fmt = settings.get("format_integer")
+    return lambda v: format(v, fmt)
+
+
+@formatter("FLOAT", "FLOAT64")
+def float_formatter(settings):
+    fmt = settings.get("format_float")
+    return lambda v: format(v, fmt)
+
+
+@formatter("NUMERIC", "BIGNUMERIC")
+def numeric_formatter(settings):
+    fmt = settings.get("format_numeric", "default")
+    if fmt == "default":
+        return truncated(str, settings.get("maxwidth"))
+    return truncated(lambda v: format(v, fmt), settings.get("maxwidth"))
+
+
+def temporal_formatter(fmt, settings):
+    if fmt == "iso":
+        return truncated(str, settings.get("maxwidth"))
+    return truncated(lambda v: v.strftime(fmt), settings.get("maxwidth"))
+
+
+@formatter("TIMESTAMP")
+def timestamp_formatter(settings):
+    format_datetime = temporal_formatter(
+        settings.get("format_timestamp", "iso"), settings
+    )
+
+    def format_timestamp(v):
+        # microseconds since epoch
+        if isinstance(v, int):
+            v = epoch + timedelta(microseconds=v)
+        return format_datetime(v)
+
+    return format_timestamp
+
+
+@formatter("DATETIME")
+def datetime_formatter(settings):
+    return temporal_formatter(settings.get("format_datetime", "iso"), settings)
+
+
+@formatter("DATE")
+def date_formatter(settings):
+    return temporal_formatter(settings.get("format_date", "iso"), settings)
+
+
+@formatter("BYTES")
+def bytes_formatter(settings):
+    encoding = settings.get("format_bytes", "base64")
+    maxwidth = settings.get("maxwidth")
+    if encoding == "hex":
+        encode, chars_per_byte = bytes.hex, 2
+    elif encoding == "base64":
+        encode, chars_per_byte = (
+            lambda v: base64.b64encode(v).decode("ascii"), 4 / 3
+        )
+    else:
+        raise ValueError(f"Unknown encoding {encoding}, expected hex or base64")
+
+    if maxwidth is None:
+        # blobs can take megabytes, even the expanded view only shows their start
+        maxwidth = settings.get("max_expanded_width", 100) * expanded_bytes_lines
+
+    # only encode as many bytes as will be displayed
+    max_bytes = int(maxwidth / chars_per_byte)
+    if encoding != "hex":
+        max_bytes -= max_bytes % 3
+
+    def format_bytes(v):
+        if len(v) > max_bytes:
+            return encode(v[:max_bytes]) + "..."
+        return encode(v)
+
+    return format_bytes
+
+
+def string_formatter(settings):
+    return truncated(str, settings.get("maxwidth"))
@@ -0,0 +1,305 @@
+"""Loads local CSV/JSONL/Parquet files into a table with parallel load jobs
+
+Files are split into chunks at line ends and every chunk is uploaded with its
+own `load_table_from_file` job, so several uploads run at once instead of a
+single stream. CSV files are expected to start with a header row, values with
+newlines inside quotes only work if the file fits in a single chunk. Parquet
+files are never split, loading many of them at once is parallel already.
+
+Load jobs get ids made of the run id and the chunk, so after an error the job is
+looked up instead of uploading the chunk again and appending its rows twice, and
+loading the same files with the same run id skips the chunks it loaded before.
+"""
+import hashlib
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from google.api_core import exceptions
+from google.cloud import bigquery
+
+from bqrepl.api import ApiClient, existing_job
+from bqrepl.stats import format_bytes
+
+source_formats = {
+    ".csv": bigquery.SourceFormat.CSV,
+    ".json": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    ".jsonl": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    ".ndjson": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    ".parquet": bigquery.SourceFormat.PARQUET,
+}
+
+Chunk = namedtuple("Chunk", ["path", "start", "length", "first"])
+
+
+def parse_schema(text):
+    """Schema from `name:TYPE,name:TYPE` text, type defaults to STRING"""
+    schema = []
+    for column in text.split(","):
+        name, _, field_type = column.strip().partition(":")
+        schema.append(bigquery.SchemaField(name, (field_type or "STRING").upper()))
+    return schema
+
+
+def source_format(path):
+    """Source format of the file by its extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in source_formats:
+        raise ValueError(
+            f"Unknown format of {path}, expected one of: {', '.join(source_formats)}"
+        )
+    return source_formats[ext]
+
+
+def split_file(path, chunk_size, fmt):
+    """Chunks of about `chunk_size` bytes, ending at line ends"""
+    size = os.path.getsize(path)
+    if fmt == bigquery.SourceFormat.PARQUET or size <= chunk_size:
+        return [Chunk(path, 0, size, True)]
+
+    chunks = []
+    start = 0
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append(Chunk(path, start, end - start, start == 0))
+            start = end
+    return chunks
+
+
+class ChunkReader:
+    """Read-only file object over a chunk of a file
+
+    Bytes read for the first time are reported to `on_read`, so re-reading a
+    chunk for a retry doesn't count twice.
+    """
+
+    def __init__(self, chunk, on_read=None):
+        self.chunk = chunk
+        self.on_read = on_read
+        self._f = open(chunk.path, "rb")
+        self._pos = 0
+        self._seen = 0
+
+    def read(self, size=-1):
+        remaining = self.chunk.length - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        self._f.seek(self.chunk.start + self._pos)
+        data = self._f.read(size)
+        self._pos += len(data)
+        if self._pos > self._seen:
+            if self.on_read is not None:
+                self.on_read(self._pos - self._seen)
+            self._seen = self._pos
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.chunk.length
+        self._pos = max(0, min(offset, self.chunk.length))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    @property
+    def uploaded(self):
+        """Whether the whole chunk was read"""
+        return self._seen == self.chunk.length
+
+    def close(self):
+        self._f.close()
+
+
+class LoadProgress:
+    """Bytes and chunks uploaded so far, updated from the upload threads
+
+    on_change: callable getting the progress after every update
+    """
+
+    def __init__(self, total_bytes, total_chunks, on_change=None):
+        self.on_change = on_change
+        self.total_bytes = total_bytes
+        self.total_chunks = total_chunks
+        self.bytes = 0
+        self.chunks = 0
+        self.rows = 0
+        self.skipped = 0
+        self.t0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes += n
+        self._changed()
+
+    def chunk_done(self, rows):
+        with self._lock:
+            self.chunks += 1
+            self.rows += rows or 0
+        self._changed()
+
+    def chunk_skipped(self, length, rows):
+        """Counts a chunk loaded by an earlier run as done"""
+        with self._lock:
+            self.bytes += length
+            self.chunks += 1
+            self.rows += rows or 0
+            self.skipped += 1
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.t0
+
+    @property
+    def throughput(self):
+        """Bytes per second"""
+        return self.bytes / max(self.elapsed, 1e-6)
+
+    def __str__(self):
+        percent = self.bytes / self.total_bytes if self.total_bytes else 1
+        elapsed = timedelta(seconds=int(self.elapsed))
+        line = (
+            f"{format_bytes(self.bytes)}/{format_bytes(self.total_bytes)} "
+            f"({percent:.0%}), {self.chunks}/{self.total_chunks} chunks, "
+            f"{format_bytes(self.throughput)}/s, {elapsed}"
+        )
+        if self.skipped:
+            line += f", {self.skipped} loaded before"
+        return line
+
+
+def job_config(fmt, chunk, schema):
+    config = bigquery.LoadJobConfig(
+        source_format=fmt,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    if schema:
+        config.schema = schema
+    elif fmt != bigquery.SourceFormat.PARQUET:
+        config.autodetect = True
+    if fmt == bigquery.SourceFormat.CSV:
+        config.skip_leading_rows = 1 if chunk.first else 0
+    return config
+
+
+def chunk_job_id(run_id, chunk):
+    """Id prefix of the chunk's load jobs, changing with the file's contents"""
+    stat = os.stat(chunk.path)
+    key = f"{os.path.abspath(chunk.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    digest = hashlib.sha1(f"{key}:{chunk.start}".encode()).hexdigest()[:16]
+    return f"bqrepl_load_{run_id}_{digest}"
+
+
+def dataset_location(api, client, table_id):
+    """Location of the table's dataset, which its load jobs run in"""
+    dataset_id = table_id.rsplit(".", 1)[0]
+    try:
+        return api.call("get_dataset", client.get_dataset, dataset_id).location
+    except exceptions.NotFound:
+        return None
+
+
+def chunk_job(client, reader, chunk, table_id, config, job_id, location=None):
+    """Waits for the chunk's load job, submitting it unless it exists already
+
+    Jobs that failed before are submitted again with the next id, as job ids
+    can't be reused. Jobs are looked up in `location`, which regional jobs need.
+    """
+    for n in itertools.count():
+        attempt_id = f"{job_id}_{n}"
+        submitted = False
+        try:
+            job = client.get_job(attempt_id, location=location)
+        except exceptions.NotFound:
+            try:
+                job = client.load_table_from_file(
+                    reader, table_id, job_id=attempt_id, location=location,
+                    rewind=True, size=chunk.length, job_config=config,
+                )
+                submitted = True
+            except exceptions.Conflict as e:
+                # an upload that seemed to fail did create the job
+                job = existing_job(client, attempt_id, e, location=location)
+        if not submitted and job.state == "DONE" and job.error_result:
+            continue
+        job.result()
+        return job
+
+
+def load_chunk(api, client, chunk, table_id, config, progress, job_id, location):
+    """Loads a chunk with a load job, made through `api` to retry transient errors
+
+    Retrying `chunk_job` looks the job up first, so the chunk is never appended
+    twice.
+    """
+    reader = ChunkReader(chunk, on_read=progress.add_bytes)
+    try:
+        job = api.call(
+            "load_chunk", chunk_job, client, reader, chunk, table_id, config, job_id,
+            location,
+        )
+    finally:
+        reader.close()
+    if reader.uploaded:
+        progress.chunk_done(job.output_rows)
+    else:
+        progress.chunk_skipped(chunk.length, job.output_rows)
+    return job
+
+
+def load_files(
+    client, paths, table_id, schema=None, chunk_size=64 * 1024 * 1024, workers=4,
+    on_progress=None, run_id=None, api=None,
+):
+    """Appends rows of the files to the table, creating it if needed
+
+    Without `schema` it's detected from the first chunk, loaded before the
+    others so that all of them get the same one.
+    on_progress: callable getting `LoadProgress` whenever it changes
+    run_id: id of an earlier run to resume, a new one by default
+    Calls are made through `api`, an `ApiClient`, if given.
+    Returns the final `LoadProgress`.
+    """
+    formats = {source_format(p) for p in paths}
+    if len(formats) > 1:
+        raise ValueError("All files have to be in the same format")
+    fmt = formats.pop()
+
+    chunks = [c for p in paths for c in split_file(p, chunk_size, fmt)]
+    progress = LoadProgress(
+        sum(c.length for c in chunks), len(chunks), on_change=on_progress
+    )
+    run_id = run_id or uuid.uuid4().hex[:12]
+    api = api or ApiClient()
+    location = dataset_location(api, client, table_id)
+
+    def load(chunk):
+        config = job_config(fmt, chunk, schema)
+        return load_chunk(
+            api, client, chunk, table_id, config, progress,
+            chunk_job_id(run_id, chunk), location,
+        )
+
+    if schema is None and fmt != bigquery.SourceFormat.PARQUET:
+        load(chunks.pop(0))
+        schema = api.call("get_table", client.get_table, table_id).schema
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(load, chunks))
+    return progress
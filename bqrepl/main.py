@@ -1,18 +1,26 @@
 import os
 import re
+import glob
+import threading
+import json
 import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from shutil import get_terminal_size
 from copy import deepcopy
 from datetime import datetime
 from collections import namedtuple
+from fnmatch import fnmatch
+from itertools import islice
 
 import requests
 import pytz
 import click
-from click import echo, echo_via_pager, secho, style, unstyle
+from click import echo, echo_via_pager, secho, style
 from logzero import logger
+from google.api_core import exceptions
 from google.oauth2 import service_account
-from google.cloud import bigquery
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.lexers import PygmentsLexer
@@ -24,6 +32,31 @@ from prompt_toolkit.completion import WordCompleter
 from bqrepl import __version__
 from bqrepl.completer import BQCompleter
 from bqrepl.lexer import BQLexer
+from bqrepl.backend import BigQueryBackend
+from bqrepl.api import (
+    ApiClient,
+    ApiRows,
+    api_errors,
+    error_messages,
+    existing_job,
+    listed,
+    transient_errors,
+)
+from bqrepl.prefetch import PrefetchIterator, rows_before
+from bqrepl.preview import PreviewCache, fetch_preview
+from bqrepl.metadata import MetadataCache, SchemaWatcher, full_id, watch_job_prefix
+from bqrepl.load import load_files, parse_schema
+from bqrepl.sinks import ResultHandle
+from bqrepl.stats import JobStatsStore, format_bytes
+from bqrepl.bench import load_workload, run_benchmark, summarize
+from bqrepl.formatters import check_format, get_formatter
+from bqrepl.rewriter import (
+    displayed_columns,
+    dry_run_bytes,
+    parse_select_star,
+    partition_filter,
+    rewrite,
+)
 from bqrepl.config import help_commands, help_options, default_settings
 
 prompt_style = Style.from_dict(
@@ -36,22 +69,63 @@ prompt_style = Style.from_dict(
 )
 
 
+def style_parts(color, **styles):
+    """ANSI codes that go before and after text styled with `styles`"""
+    if not color:
+        return "", ""
+    prefix, suffix = style("\0", **styles).split("\0")
+    return prefix, suffix
+
+
+class Counted:
+    """Iterates over `items`, counting how many were taken"""
+
+    def __init__(self, items):
+        self.items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.count += 1
+            yield item
+
+
 class BQREPL:
-    def __init__(self, credentials_file=None, project=None):
+    def __init__(
+        self, credentials_file=None, project=None, backend=None, check_version=True
+    ):
 
-        self.settings = default_settings
+        self.settings = dict(default_settings)
         self.settings["project"] = project
         self.credentials_file = credentials_file
+        self.backend = backend or BigQueryBackend()
         self.session = None
         self.prompt = None
         self.client = None
         self.credentials = None
+        self.pending = None
+        self.api = ApiClient(self.settings)
+        self.previews = PreviewCache(api=self.api, get_table=self.get_table_metadata)
+        self.job_stats = JobStatsStore()
+        self.jobs_page_token = None
+        self.jobs_page_size = 20
+        # (files, table) -> run id of a \load that failed, resumed when run again
+        self.failed_loads = {}
+        self.metadata = MetadataCache(api=self.api)
+        self.watcher = SchemaWatcher(
+            self.metadata, self.settings, lambda: self.client,
+            on_change=self.previews.invalidate,
+        )
         self.__version__ = __version__
 
         if not os.environ.get("LESS"):
             os.environ["LESS"] = "-SRXF"
 
-        # check latest version
+        if check_version:
+            self.check_version()
+
+    def check_version(self):
+        """Lets the user know if there's a newer version available"""
         url = "https://raw.githubusercontent.com/bartekpi/bqrepl/main/bqrepl/__init__.py"  # noqa
         try:
             response = requests.get(url)
@@ -77,14 +151,15 @@ class BQREPL:
 
     def connect_client(self):
         """Connects to BQ"""
-        if not self.credentials:
+        if not self.credentials and self.backend.requires_credentials:
             self.set_credentials()
 
-        client = bigquery.Client(
+        client = self.backend.client(
             project=self.settings.get("project"), credentials=self.credentials
         )
         self.client = client
         self.prompt = "[{}] ~> ".format(self.settings.get("project", ""))
+        self.watcher.start()
 
     def start_session(self):
         sql_completer = BQCompleter()
@@ -109,7 +184,7 @@ class BQREPL:
                         "Please provide project ID: ",
                         completer=WordCompleter(available_projects)
                         )
-                    client_test = bigquery.Client(
+                    client_test = self.backend.client(
                         project=project, credentials=self.credentials
                     )
                     available_projects = [
@@ -156,14 +231,32 @@ class BQREPL:
         self.settings["project"] = project
         self.connect_client()
 
+    def list_tables_metadata(self, dataset):
+        """Tables in dataset, cached while the schema watcher is enabled"""
+
+        if self.settings["metadata_refresh_interval"] > 0:
+            return self.metadata.list_tables(self.client, dataset)
+        return self.api.call(
+            "list_tables", listed(self.client.list_tables), dataset, coalesce=True
+        )
+
+    def get_table_metadata(self, table):
+        """Table metadata, cached while the schema watcher is enabled"""
+
+        if self.settings["metadata_refresh_interval"] > 0:
+            return self.metadata.get_table(self.client, table)
+        return self.api.call("get_table", self.client.get_table, table, coalesce=True)
+
     def list_projects(self):
         """Lists all projects this service accounts has access to"""
 
         try:
-            client_results = list(self.client.list_projects())
-        except Exception as e:
+            client_results = self.api.call(
+                "list_projects", listed(self.client.list_projects), coalesce=True
+            )
+        except api_errors as e:
             logger.error("Something went wrong fetching projects")
-            for err_dict in e.errors:
+            for err_dict in error_messages(e):
                 logger.error(err_dict)
             return
 
@@ -180,10 +273,13 @@ class BQREPL:
         """Lists all datasets in the project."""
 
         try:
-            client_results = list(self.client.list_datasets(project=project))
-        except Exception as e:
+            client_results = self.api.call(
+                "list_datasets", listed(self.client.list_datasets), project=project,
+                coalesce=True,
+            )
+        except api_errors as e:
             logger.error("Something went wrong fetching datasets")
-            for err_dict in e.errors:
+            for err_dict in error_messages(e):
                 logger.error(err_dict)
             return
 
@@ -215,10 +311,10 @@ class BQREPL:
             logger.error("Too many parts in dataset reference. Expecting max 2")
             return
         try:
-            client_results = list(self.client.list_tables(dataset))
-        except Exception as e:
+            client_results = self.list_tables_metadata(dataset)
+        except api_errors as e:
             logger.error("Something went wrong fetching tables")
-            for err_dict in e.errors:
+            for err_dict in error_messages(e):
                 logger.error(err_dict)
             return
 
@@ -249,14 +345,25 @@ class BQREPL:
 
         self.show_results(data, schema)
 
+        # tables just listed are the ones likely to get previewed next
+        tables = [
+            f"{x.project}.{x.dataset_id}.{x.table_id}"
+            for x in client_results
+            if x._properties.get("type") == "TABLE"
+        ]
+        for table_id in tables[: self.settings["preview_prefetch"]]:
+            self.previews.prefetch(
+                self.client, table_id, self.resolve_maxrows()
+            )
+
     def list_columns(self, table):
         """List all columns in table"""
 
         try:
-            client_results = self.client.get_table(table)
-        except Exception as e:
+            client_results = self.get_table_metadata(table)
+        except api_errors as e:
             logger.error("Something went wrong fetching table")
-            for err_dict in e.args:
+            for err_dict in error_messages(e):
                 logger.error(err_dict)
             return
 
@@ -289,6 +396,278 @@ class BQREPL:
 
         self.show_results(data, schema)
 
+    def list_jobs(self, max_results=20, page_token=None):
+        """Lists recent jobs in the project, a page at a time"""
+
+        def fetch_page():
+            jobs_iter = self.client.list_jobs(
+                max_results=max_results, page_token=page_token
+            )
+            # jobs of the schema watcher would crowd out the user's own
+            jobs = [j for j in jobs_iter if not j.job_id.startswith(watch_job_prefix)]
+            return jobs, jobs_iter.next_page_token
+
+        try:
+            client_results, self.jobs_page_token = self.api.call(
+                "list_jobs", fetch_page
+            )
+        except api_errors as e:
+            logger.error("Something went wrong fetching jobs")
+            for err_dict in error_messages(e):
+                logger.error(err_dict)
+            return
+
+        Schema = namedtuple("Schema", ["name", "field_type"])
+
+        schema = [
+            Schema("job_id", "STRING"),
+            Schema("job_type", "STRING"),
+            Schema("state", "STRING"),
+            Schema("created", "DATETIME"),
+            Schema("duration", "FLOAT"),
+            Schema("bytes_processed", "STRING"),
+            Schema("bytes_billed", "STRING"),
+            Schema("slot_ms", "INTEGER"),
+            Schema("cache_hit", "STRING"),
+            Schema("query", "STRING"),
+        ]
+
+        data = []
+        for x in client_results:
+            started, ended = getattr(x, "started", None), getattr(x, "ended", None)
+            data.append(
+                dict(
+                    job_id=x.job_id,
+                    job_type=x.job_type,
+                    state=x.state,
+                    created=x.created,
+                    duration=(ended - started).total_seconds()
+                    if started and ended else None,
+                    bytes_processed=format_bytes(
+                        getattr(x, "total_bytes_processed", None)
+                    ),
+                    bytes_billed=format_bytes(getattr(x, "total_bytes_billed", None)),
+                    slot_ms=getattr(x, "slot_millis", None),
+                    cache_hit=getattr(x, "cache_hit", None),
+                    query=getattr(x, "query", None),
+                )
+            )
+
+        self.show_results(data, schema)
+        if self.jobs_page_token:
+            echo("More jobs available, " + style("\\jobs next", fg="bright_black"))
+
+    def show_job_stats(self):
+        """Shows statistics and query plan of the last query"""
+
+        if not len(self.job_stats):
+            secho("No queries run yet", fg="yellow")
+            return
+        stats = self.job_stats.last()[0]
+
+        Schema = namedtuple("Schema", ["name", "field_type"])
+
+        schema = [Schema("stat", "STRING"), Schema("value", "STRING")]
+        data = [
+            dict(stat="job_id", value=stats["job_id"]),
+            dict(stat="project", value=stats["project"]),
+            dict(stat="started", value=stats["started"]),
+            dict(stat="duration", value=stats["duration"]),
+            dict(stat="bytes_processed", value=format_bytes(stats["bytes_processed"])),
+            dict(stat="bytes_billed", value=format_bytes(stats["bytes_billed"])),
+            dict(stat="slot_ms", value=stats["slot_ms"]),
+            dict(stat="cache_hit", value=stats["cache_hit"]),
+        ]
+        self.show_results(data, schema)
+
+        if not stats["stages"]:
+            return
+
+        schema = [
+            Schema("stage", "STRING"),
+            Schema("status", "STRING"),
+            Schema("wait_avg", "FLOAT"),
+            Schema("wait_max", "FLOAT"),
+            Schema("read_avg", "FLOAT"),
+            Schema("read_max", "FLOAT"),
+            Schema("compute_avg", "FLOAT"),
+            Schema("compute_max", "FLOAT"),
+            Schema("write_avg", "FLOAT"),
+            Schema("write_max", "FLOAT"),
+            Schema("skew", "FLOAT"),
+            Schema("records_read", "INTEGER"),
+            Schema("records_written", "INTEGER"),
+            Schema("shuffle_bytes", "STRING"),
+            Schema("shuffle_spilled", "STRING"),
+            Schema("slot_ms", "INTEGER"),
+        ]
+        data = [
+            dict(
+                stage,
+                shuffle_bytes=format_bytes(stage["shuffle_bytes"]),
+                shuffle_spilled=format_bytes(stage["shuffle_spilled"]),
+            )
+            for stage in stats["stages"]
+        ]
+        self.show_results(data, schema)
+
+    def show_api_stats(self):
+        """Shows counts of API calls, retries and rate limiter waits by method"""
+
+        stats = self.api.stats()
+        if not stats:
+            secho("No API calls made yet", fg="yellow")
+            return
+
+        Schema = namedtuple("Schema", ["name", "field_type"])
+
+        counters = [
+            "calls", "retries", "failures", "coalesced", "throttled",
+            "throttle_ms", "backoff_ms",
+        ]
+        schema = [Schema("method", "STRING")] + [
+            Schema(x, "INTEGER") for x in counters
+        ]
+        data = [
+            dict(method=method, **{x: counts[x] for x in counters})
+            for method, counts in sorted(stats.items())
+        ]
+        data.append(
+            dict(
+                method="total",
+                **{x: sum(counts[x] for counts in stats.values()) for x in counters},
+            )
+        )
+        self.show_results(data, schema)
+
+    def show_stats_history(self, n):
+        """Shows statistics of the last `n` queries"""
+
+        Schema = namedtuple("Schema", ["name", "field_type"])
+
+        schema = [
+            Schema("job_id", "STRING"),
+            Schema("project", "STRING"),
+            Schema("started", "DATETIME"),
+            Schema("duration", "FLOAT"),
+            Schema("bytes_processed", "STRING"),
+            Schema("bytes_billed", "STRING"),
+            Schema("slot_ms", "INTEGER"),
+            Schema("cache_hit", "STRING"),
+            Schema("query", "STRING"),
+        ]
+        data = [
+            dict(
+                stats,
+                bytes_processed=format_bytes(stats["bytes_processed"]),
+                bytes_billed=format_bytes(stats["bytes_billed"]),
+            )
+            for stats in self.job_stats.last(n)
+        ]
+
+        self.show_results(data, schema)
+
+    def preview_table(self, table, max_results=None, fields=None):
+        """Shows first rows of a table without running a query"""
+
+        table = table.strip("`")
+        if len(table.split(".")) == 2:
+            table = f"{self.settings.get('project')}.{table}"
+        if max_results is None:
+            max_results = self.resolve_maxrows(len(fields or [None]))
+
+        table_info = None
+        future = self.previews.get(table, max_results)
+        if future is not None:
+            try:
+                table_info, rows = future.result()
+                rows = rows[:max_results]
+            except api_errors:
+                self.previews.invalidate(table)
+
+        names = [x.name for x in table_info.schema] if table_info else []
+        if table_info is None or any(f not in names for f in fields or []):
+            try:
+                table_info, rows = fetch_preview(
+                    self.client, table, max_results, fields,
+                    get_table=self.get_table_metadata, api=self.api,
+                )
+            except ValueError as e:
+                secho(str(e), fg="red")
+                return
+            except api_errors as e:
+                logger.error("Something went wrong fetching table preview")
+                for err_dict in error_messages(e):
+                    logger.error(err_dict)
+                return
+
+        schema = [x for x in table_info.schema if not fields or x.name in fields]
+
+        self.show_results(rows, schema)
+
+    def load_table(self, pattern, table, schema=None):
+        """Loads local files matching the glob pattern into a table"""
+
+        paths = sorted(glob.glob(os.path.expanduser(pattern)))
+        if not paths:
+            secho(f"No files matching {pattern}", fg="red")
+            return
+        table_id = full_id(self.settings.get("project"), table)
+        if len(table_id.split(".")) != 3:
+            secho("Expected [PROJECT.]DATASET.TABLE", fg="red")
+            return
+
+        lock = threading.Lock()
+        shown = dict(at=0.0, width=0)
+
+        def show_progress(progress, final=False):
+            # progress changes with every block read, redraw a few times a second
+            with lock:
+                if final or time.monotonic() - shown["at"] >= 0.2:
+                    line = str(progress)
+                    echo("\r" + line.ljust(shown["width"]), nl=final)
+                    shown.update(at=time.monotonic(), width=len(line))
+
+        key = (tuple(paths), table_id)
+        run_id = self.failed_loads.pop(key, None)
+        if run_id is not None:
+            echo(f"Resuming load {run_id}, skipping chunks loaded before")
+        else:
+            run_id = uuid.uuid4().hex[:12]
+
+        try:
+            progress = load_files(
+                self.client, paths, table_id,
+                schema=parse_schema(schema) if schema else None,
+                chunk_size=self.settings["load_chunk_mb"] * 1024 * 1024,
+                workers=self.settings["load_workers"],
+                on_progress=show_progress,
+                run_id=run_id,
+                api=self.api,
+            )
+        except ValueError as e:
+            echo()
+            secho(str(e), fg="red")
+            return
+        except api_errors as e:
+            echo()
+            self.failed_loads[key] = run_id
+            logger.error("Something went wrong loading the files")
+            for err_dict in error_messages(e):
+                logger.error(err_dict)
+            secho("Run the same \\load again to resume", fg="yellow")
+            return
+        finally:
+            self.metadata.invalidate_table(table_id)
+            self.metadata.invalidate_dataset(table_id.rsplit(".", 1)[0])
+            self.previews.invalidate(table_id)
+
+        show_progress(progress, final=True)
+        echo(
+            f"Loaded {progress.rows} rows from {len(paths)} file(s) into "
+            + style(table_id, fg="bright_black")
+        )
+
     def print_help(self):
         Schema = namedtuple("Schema", ["name", "field_type"])
 
@@ -304,146 +683,195 @@ class BQREPL:
 
         self.show_results(data, schema)
 
-    def format_values(self, data, columns, widths, total_rows, settings):
-        """Prepares formatted results"""
+    def iter_values(self, data, columns, total_rows, settings, deadline=None):
+        """Yields formatted values of each row, stopping early once `deadline` passes
 
-        # column widths will get updated as values are formatted
-        widths_ = deepcopy(widths)
+        Values other than numbers are truncated to `maxwidth`, unless it's None.
+        """
+
+        if deadline is not None:
+            data = rows_before(data, deadline)
 
-        values = []
+        names = [col_name for col_name, col_type in columns]
+        formatters = [
+            get_formatter(col_type, settings) for col_name, col_type in columns
+        ]
         for row_i, row in enumerate(data):
-            row_values = []
-            for col_name, col_type in columns:
-                v = row.get(col_name)
-                if v is None:
-                    formatted_value = None
-                else:
-                    if col_type == "INTEGER":
-                        fmt = settings.get("format_integer")
-                        formatted_value = f"{v:{fmt}}"
-                    elif col_type == "FLOAT":
-                        fmt = settings.get("format_float")
-                        formatted_value = f"{v:{fmt}}"
-                    else:
-                        formatted_value = str(v)[: settings.get("maxwidth")]
-                        if len(str(v)) > settings.get("maxwidth"):
-                            formatted_value += "..."
-                if formatted_value is None:
-                    widths_["values"][col_name] = max(
-                        4, widths_.get("values").get(col_name)
-                    )
-                elif len(formatted_value) > widths_.get("values").get(col_name):
-                    widths_["values"][col_name] = len(formatted_value)
-                row_values.append(formatted_value)
-            values.append(row_values)
+            row_values = [
+                None if v is None else format_value(v)
+                for v, format_value in zip(map(row.get, names), formatters)
+            ]
+            yield row_values
             if (row_i == settings.get("maxrows") - 1) & (row_i != total_rows - 1):
                 break
 
+    def format_values(self, data, columns, widths, total_rows, settings, deadline=None):
+        """Prepares formatted results, stopping early once `deadline` passes"""
+
+        # column widths will get updated as values are formatted
+        widths_ = deepcopy(widths)
+
+        values = list(
+            self.iter_values(data, columns, total_rows, settings, deadline=deadline)
+        )
+
+        for (col_name, col_type), column in zip(columns, zip(*values)):
+            width = max(
+                widths_["values"][col_name],
+                max(map(len, filter(None, column)), default=0),
+            )
+            if None in column:
+                width = max(4, width)
+            widths_["values"][col_name] = width
+
         return values, widths_
 
-    def format_rows(self, values, columns, widths, settings):
+    def use_color(self, settings):
+        """Whether output gets styled, `auto` styles only when printing to a TTY"""
+
+        color = settings.get("color", "auto")
+        if color == "auto":
+            return sys.stdout.isatty()
+        return color == "on"
+
+    def format_rows(self, values, columns, widths, settings, start=0):
         """Prepare formatted rows, ready for printing"""
 
+        color = self.use_color(settings)
+        header_prefix, header_suffix = style_parts(color, fg="blue", bold=True)
+        name_prefix, name_suffix = style_parts(color, fg="green")
+        type_prefix, type_suffix = style_parts(color, fg="cyan")
+        row_prefix, row_suffix = style_parts(color, fg="blue")
+        null_prefix, null_suffix = style_parts(color, fg="bright_red")
+        null = null_prefix + "null" + null_suffix
+
+        col_widths = [
+            max(widths["values"][x], widths["columns"][x]) for x, y in columns
+        ]
+
         formatted_rows = []
 
-        formatted_row = style(" row", fg="blue", bold=True) + " |"
+        formatted_row = header_prefix + " row" + header_suffix + " |"
         formatted_row += "|".join(
             [
-                " "
-                + style(x, fg="green")
-                + " " * (max(widths["values"][x], widths["columns"][x]) - len(x) + 1)
-                for x, y in columns
+                " " + name_prefix + x + name_suffix + " " * (w - len(x) + 1)
+                for (x, y), w in zip(columns, col_widths)
             ]
         )
         formatted_row += "|"
         formatted_rows.append(formatted_row)
 
-        formatted_row = "     |"
-        for x, y in columns:
-            formatted_value = (
-                style(" " + y, fg="cyan")
-                + " " * (max(widths["values"][x], widths["columns"][x]) - len(y) + 1)
-                + "|"
-            )
-            formatted_row += formatted_value
-        formatted_rows.append(formatted_row)
-        separator_row = "-----|"
-        separator_row += "+".join(
+        formatted_row = "     |" + "".join(
             [
-                "-" * (max(widths["values"][x], widths["columns"][x]) + 2)
-                for x, y in columns
+                type_prefix + " " + y + type_suffix + " " * (w - len(y) + 1) + "|"
+                for (x, y), w in zip(columns, col_widths)
             ]
         )
+        formatted_rows.append(formatted_row)
+
+        separator_row = "-----|"
+        separator_row += "+".join(["-" * (w + 2) for w in col_widths])
         separator_row += "|"
 
         final_row = "-" * len(separator_row)
 
-        for i, row in enumerate(values):
-            if i == 0:
-                formatted_rows.append(separator_row)
-            formatted_row = style(f" {i:3,d}", fg="blue")
-            for value, (col_name, col_type) in zip(row, columns):
-                formatted_row += " | "
-                if value is not None:
-                    formatted_value = value
-                    try:
-                        len_value = len(value)
-                    except TypeError:
-                        len_value = 0
-                else:
-                    formatted_value = style("null", fg="bright_red")
-                    len_value = 4
-                whitespace = " " * (
-                    max(widths["columns"][col_name], widths["values"][col_name])
-                    - len_value
-                )
-                if col_type in ("INTEGER", "FLOAT"):
-                    formatted_row += whitespace + formatted_value
-                else:
-                    formatted_row += formatted_value + whitespace
-            formatted_row += " |"
-            formatted_rows.append(formatted_row)
+        # (right aligned, width, padded null) for every column
+        layout = [
+            (True, w, " " * (w - 4) + null)
+            if y in ("INTEGER", "FLOAT")
+            else (False, w, null + " " * (w - 4))
+            for (x, y), w in zip(columns, col_widths)
+        ]
+
+        if values:
+            formatted_rows.append(separator_row)
+        for i, row in enumerate(values, start):
+            cells = [
+                null_value if value is None
+                else value.rjust(width) if right
+                else value.ljust(width)
+                for value, (right, width, null_value) in zip(row, layout)
+            ]
+            formatted_rows.append(
+                f"{row_prefix} {i:3,d}{row_suffix} | " + " | ".join(cells) + " |"
+            )
 
         formatted_rows.append(final_row)
 
         return formatted_rows, len(final_row)
 
-    def format_rows_expanded(self, values, columns, widths, settings):
-        """Prepare formatted rows in extended view, ready for printing"""
+    def format_rows_expanded(self, values, columns, settings, start=0):
+        """Prepare formatted rows in extended view, ready for printing
 
-        formatted_rows = []
+        Returns a generator of lines, formatting one record at a time, and the
+        table width. Values longer than `max_expanded_width`, or than what fits in
+        the terminal, are wrapped.
+        """
+
+        color = self.use_color(settings)
+        row_prefix, row_suffix = style_parts(color, fg="blue", bold=True)
+        name_prefix, name_suffix = style_parts(color, fg="bright_green")
+        null_prefix, null_suffix = style_parts(color, fg="red")
 
-        row_delimiter_template = "-[ " + style("row {}", fg="blue", bold=True) + " ]-"
         max_col_name_width = max([len(x[0]) for x in columns])
-        max_col_value_width = min(
-            self.settings["max_expanded_width"], max(4, max(widths["values"].values()))
-        )
+        max_col_value_width = max(4, min(
+            settings["max_expanded_width"],
+            get_terminal_size().columns - max_col_name_width - 3,
+        ))
         max_table_width = max_col_name_width + max_col_value_width + 3
-        for i, row in enumerate(values):
-            formatted_row = row_delimiter_template.format(f"{i:,d}")
-            # calculate length of this header but substract what's inside tags
-            row_len = len(unstyle(formatted_row))
-            if max_table_width >= row_len:
-                fills = max_table_width - row_len
-                formatted_row += "-" * fills
-
-            formatted_rows.append(formatted_row)
-
-            for value, (col_name, col_type) in zip(row, columns):
-                formatted_row = style(
-                    f"{col_name:{max_col_name_width}}", fg="bright_green")
-
-                if value is None:
-                    value = style("null", fg="red") + " " * (max_col_value_width - 4)
-                else:
-                    value = f"{value:{max_col_value_width}}"
-                formatted_row += " | " + value
+        null = null_prefix + "null" + null_suffix
+        names = [
+            name_prefix + f"{col_name:{max_col_name_width}}" + name_suffix + " | "
+            for col_name, col_type in columns
+        ]
+        continuation = " " * max_col_name_width + " | "
+
+        def lines():
+            for i, row in enumerate(values, start):
+                row_number = f"{i:,d}"
+                # length of the header without the styling
+                row_len = len(row_number) + 10
+                yield (
+                    "-[ " + row_prefix + "row " + row_number + row_suffix + " ]-"
+                    + "-" * max(0, max_table_width - row_len)
+                )
+
+                for value, name in zip(row, names):
+                    if value is None:
+                        yield name + null
+                        continue
+                    prefix = name
+                    for line in value.split("\n"):
+                        for j in range(0, max(1, len(line)), max_col_value_width):
+                            yield prefix + line[j: j + max_col_value_width]
+                            prefix = continuation
+
+        return lines(), max_table_width
+
+    def filter_columns(self, columns, settings):
+        """Columns matching the `expanded_columns` patterns, all if there are none"""
+
+        patterns = [x for x in settings.get("expanded_columns", "").split(",") if x]
+        if not patterns:
+            return columns
+        return [
+            (name, field_type) for name, field_type in columns
+            if any(fnmatch(name, pattern) for pattern in patterns)
+        ]
 
-                formatted_rows.append(formatted_row)
+    def resolve_maxrows(self, num_columns=1):
+        """Maximum rows displayed, sized to the terminal when maxrows is auto"""
 
-        return formatted_rows, max_table_width
+        if self.settings["maxrows"] != "auto":
+            return self.settings["maxrows"]
 
-    def show_results(self, data, schema, t0=None):
+        lines = get_terminal_size().lines
+        if self.settings["expanded"]:
+            return max(1, (lines - 2) // (num_columns + 1))
+        # header, separator and final rows, footer and prompt
+        return max(1, lines - 6)
+
+    def show_results(self, data, schema, t0=None, start=0):
         """Prints formatted resutls"""
 
         columns = [(x.name, x.field_type) for x in schema]
@@ -456,27 +884,86 @@ class BQREPL:
         except AttributeError:
             total_rows = len(data)
 
-        values, widths = self.format_values(
-            data, columns, widths, total_rows, self.settings
-        )
+        settings = dict(self.settings, maxrows=self.resolve_maxrows(len(columns)))
+        budget = settings["display_budget_ms"]
 
-        if not self.settings["expanded"]:
-            formatted_rows, w = self.format_rows(values, columns, widths, self.settings)
-        else:
-            formatted_rows, w = self.format_rows_expanded(
-                values, columns, widths, self.settings
+        if settings["expanded"] and not self.filter_columns(columns, settings):
+            secho(f"No columns match {settings['expanded_columns']}", fg="red")
+            return
+
+        if (settings["prefetch_pages"] > 0 or budget > 0) and hasattr(data, "pages"):
+            data = PrefetchIterator(
+                data.pages, depth=max(1, settings["prefetch_pages"]),
+                total_rows=total_rows, schema=schema, limit=settings["maxrows"],
             )
+        elif isinstance(data, PrefetchIterator):
+            # \more of results that were still loading
+            data.set_limit(start + settings["maxrows"])
+
+        # previous results that were still loading won't be shown anymore
+        if self.pending is not None and self.pending[0] is not data:
+            self.pending[0].close()
+        self.pending = None
 
+        deadline = time.monotonic() + budget / 1000 if budget > 0 else None
         wmax = get_terminal_size().columns
-        if w >= wmax:
-            echo_via_pager("\n".join(formatted_rows))
-        else:
-            echo("\n".join(formatted_rows))
+        try:
+            if not settings["expanded"]:
+                values, widths = self.format_values(
+                    data, columns, widths, total_rows, settings, deadline=deadline
+                )
+                rendered = len(values)
+                formatted_rows, w = self.format_rows(
+                    values, columns, widths, settings, start=start
+                )
+                if w >= wmax:
+                    echo_via_pager("\n".join(formatted_rows))
+                else:
+                    echo("\n".join(formatted_rows))
+            else:
+                # records are formatted while they're printed, one at a time
+                columns = self.filter_columns(columns, settings)
+                values = Counted(
+                    self.iter_values(
+                        data, columns, total_rows, dict(settings, maxwidth=None),
+                        deadline=deadline,
+                    )
+                )
+                formatted_rows, w = self.format_rows_expanded(
+                    values, columns, settings, start=start
+                )
+                # values are wrapped to fit, only very narrow terminals need it
+                if w > wmax:
+                    echo_via_pager(line + "\n" for line in formatted_rows)
+                else:
+                    for line in formatted_rows:
+                        echo(line)
+                rendered = values.count
+        except BaseException:
+            if isinstance(data, PrefetchIterator):
+                data.close()
+            raise
+
+        shown = start + rendered
+        if isinstance(data, PrefetchIterator):
+            # budget ran out before maxrows got formatted, keep loading the rest
+            if deadline is not None and shown < total_rows and (
+                rendered < settings["maxrows"]
+            ):
+                self.pending = (data, schema, shown)
+            else:
+                data.close()
 
         footer_row = (
-            style(f"{len(values):,d}/{total_rows:,d} ", fg="bright_black")
+            style(f"{shown:,d}/{total_rows:,d} ", fg="bright_black")
             + "results."
         )
+        if self.pending is not None:
+            footer_row += (
+                " "
+                + style(f"{total_rows - shown:,d}", fg="bright_black")
+                + " still loading, \\more to show them."
+            )
         if t0:
             dt = datetime.now(tz=pytz.utc) - t0
             footer_row += (
@@ -530,12 +1017,100 @@ class BQREPL:
 
             self.list_columns(table)
 
-        if text in ("\\x", "\\expanded"):
+        if text.split(" ")[0] == "\\preview":
+            args = text.split()[1:]
+            if not args:
+                secho("Missing table", fg="red")
+                return
+            table, max_results, fields = args[0], None, None
+            for arg in args[1:3]:
+                if arg.isdigit():
+                    max_results = int(arg)
+                else:
+                    fields = [x.strip() for x in arg.split(",") if x.strip()]
+
+            self.preview_table(table, max_results=max_results, fields=fields)
+
+        if text.split(" ")[0] == "\\stats":
+            args = text.split()[1:]
+            if not args or args[0] == "last":
+                self.show_job_stats()
+            elif args[0].isdigit():
+                self.show_stats_history(int(args[0]))
+            elif args[0] == "api":
+                self.show_api_stats()
+            else:
+                secho("Expected \\stats [last|N|api]", fg="red")
+
+        if text.split(" ")[0] == "\\jobs":
+            args = text.split()[1:]
+            if args and args[0] == "next":
+                if not self.jobs_page_token:
+                    secho("No more jobs", fg="yellow")
+                    return
+                self.list_jobs(
+                    max_results=self.jobs_page_size, page_token=self.jobs_page_token
+                )
+            elif not args or args[0] == "history":
+                if len(args) > 1 and not args[1].isdigit():
+                    secho("Expected \\jobs history [N]", fg="red")
+                    return
+                self.jobs_page_size = int(args[1]) if len(args) > 1 else 20
+                self.list_jobs(max_results=self.jobs_page_size)
+            else:
+                secho("Expected \\jobs [history [N]|next]", fg="red")
+
+        if text.split(" ")[0] in ("\\fanout", "\\foreach"):
+            match = re.match(
+                r"^\\fanout\s+(\S+)\s+(.+)$"
+                r"|^\\foreach\s+project\s+in\s+\(([^)]*)\)\s+(.+)$",
+                text, flags=re.DOTALL | re.IGNORECASE,
+            )
+            if not match:
+                secho("Missing projects or query", fg="red")
+                return
+            projects, query = (
+                (match.group(1), match.group(2)) if match.group(1)
+                else (match.group(3), match.group(4))
+            )
+            projects = [p.strip() for p in projects.split(",") if p.strip()]
+
+            self.fanout_query(projects, query)
+
+        if text.split(" ")[0] == "\\load":
+            args = text.split()[1:]
+            if len(args) not in (2, 3):
+                secho(
+                    "Expected \\load FILE|GLOB [PROJECT.]DATASET.TABLE [SCHEMA]",
+                    fg="red",
+                )
+                return
+
+            self.load_table(*args)
+
+        if text.split(" ")[0] == "\\refresh":
+            self.metadata.clear()
+            self.previews.invalidate()
+            echo("Dropped cached metadata")
+
+        if text.split(" ")[0] == "\\more":
+            if self.pending is None:
+                secho("Nothing more to show", fg="yellow")
+                return
+
+            data, schema, start = self.pending
+            self.show_query_results(data, schema, start=start)
+
+        if text.split(" ")[0] in ("\\x", "\\expanded") and "cols=" in text:
+            self.settings["expanded_columns"] = text.split("cols=", 1)[1].strip()
+            text = "\\set expanded True"
+        elif text in ("\\x", "\\expanded"):
+            self.settings["expanded_columns"] = ""
             text = "\\set expanded {}".format(not self.settings.get("expanded"))
 
         if text.split(" ")[0] == "\\set":
             try:
-                cmd, variable, value = text.split(" ")
+                cmd, variable, value = text.split(" ", 2)
             except ValueError:
                 echo(
                     style("Ugh, I expected something like ", fg="red")
@@ -551,6 +1126,13 @@ class BQREPL:
                 return
 
             if variable.startswith("format_"):
+                try:
+                    check_format(variable, value, self.settings)
+                except ValueError as e:
+                    secho(str(e), fg="red")
+                    return
+                self.settings[variable] = value
+            elif variable == "expanded_columns":
                 self.settings[variable] = value
             elif variable == "expanded":
                 if value.lower() in ["y", "yes", "on", "true", "t", "1"]:
@@ -570,6 +1152,17 @@ class BQREPL:
                     + style("ON" if newval else "OFF", fg="bright_black")
                 )
                 echo(message)
+            elif variable == "color":
+                if value.lower() not in ("auto", "on", "off"):
+                    echo(
+                        style("Unknown value ", fg="red")
+                        + style(value, fg="red", italic=True)
+                        + style("...", fg="red")
+                    )
+                    return
+                self.settings["color"] = value.lower()
+            elif variable == "maxrows" and value.lower() == "auto":
+                self.settings["maxrows"] = "auto"
             elif variable == "project":
                 message = (
                     "Switched project to "
@@ -578,26 +1171,255 @@ class BQREPL:
                 self.set_project(value)
                 echo(message)
             else:
-                self.settings[variable] = int(value)
+                try:
+                    self.settings[variable] = int(value)
+                except ValueError:
+                    echo(
+                        style("Expected a number, got ", fg="red")
+                        + style(value, fg="red", italic=True)
+                    )
+
+    def ask(self, message):
+        """Asks user a question, None when they cancel it"""
+
+        try:
+            return prompt(message).strip().lower()
+        except (KeyboardInterrupt, EOFError):
+            return None
+
+    def check_select_star(self, text):
+        """Offers cheaper alternatives to SELECT * on big tables
+
+        Returns query to run or None if user gave up on it.
+        """
+
+        threshold = self.settings["select_star_threshold_mb"]
+        parsed = parse_select_star(text) if threshold > 0 else None
+        if parsed is None:
+            return text
+
+        try:
+            table = self.get_table_metadata(parsed[0])
+        except api_errors:
+            # let the query itself report what's wrong
+            return text
+        if (table.num_bytes or 0) < threshold * 1024 * 1024:
+            return text
+
+        fields = [(x.name, x.field_type) for x in table.schema]
+        if self.settings["expanded"]:
+            columns = [x for x, y in self.filter_columns(fields, self.settings)]
+        else:
+            columns = displayed_columns(
+                table.schema, get_terminal_size().columns, self.settings["maxwidth"]
+            )
+        condition = partition_filter(table)
+
+        options = {}
+        if len(columns) < len(fields):
+            options["c"] = (
+                f"only {len(columns)} displayed columns", rewrite(text, columns=columns)
+            )
+        if condition:
+            options["p"] = ("today's partition", rewrite(text, condition=condition))
+        if len(options) == 2:
+            options["b"] = ("both", rewrite(text, columns, condition))
+        if not options:
+            return text
+
+        try:
+            original = self.api.call("dry_run", dry_run_bytes, self.client, text)
+            estimates = {
+                k: self.api.call("dry_run", dry_run_bytes, self.client, query)
+                for k, (_, query) in options.items()
+            }
+        except api_errors as e:
+            for err_dict in error_messages(e):
+                logger.error(err_dict)
+            return text
+
+        table_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        secho(
+            f"SELECT * reads all {len(fields)} columns of {table_id} "
+            f"({format_bytes(original)})",
+            fg="yellow",
+        )
+        for key, (label, query) in options.items():
+            saved = original - estimates[key]
+            echo(
+                style(f"[{key}] ", fg="bright_black")
+                + f"{label}: {format_bytes(estimates[key])}, saves "
+                + style(
+                    f"{format_bytes(saved)} ({saved / max(1, original):.0%})",
+                    fg="green",
+                )
+            )
+
+        answer = self.ask(
+            "Run with [" + "/".join(options) + "], [r]un as is or [a]bort? "
+        )
+        if answer in options:
+            query = options[answer][1]
+            echo(style(query, fg="bright_black"))
+            return query
+        if answer in ("", "r"):
+            return text
+        return None
+
+    def query(self, sql, job_config=None):
+        """Runs query and returns a handle for reading its results into a sink
+
+        For embedding bqrepl, e.g. `bqrepl.query(sql).to_dataframe()`, so errors
+        are raised rather than logged.
+        """
+
+        query_job, rows = self.run_query(sql, job_config=job_config)
+        return ResultHandle(self, query_job, rows)
+
+    def run_query(self, text, client=None, job_config=None):
+        """Runs query job and waits for it, returns the job and its rows
+
+        The job gets its id up front, so retrying the submission after the job
+        got created fetches it instead of running the statement twice. Errors
+        waiting for the job are retried by polling the same job while it runs.
+        A query whose job failed with a transient error is run again as a new
+        job, other statements are not.
+        """
+
+        client = client or self.client
+
+        def submit(job_id):
+            try:
+                return client.query(text, job_config=job_config, job_id=job_id)
+            except exceptions.Conflict as e:
+                return existing_job(client, job_id, e)
+
+        def running(error):
+            # a failed job raises the error it ended with every time
+            return query_job.state != "DONE"
+
+        reruns = 0
+        while True:
+            query_job = self.api.call("query", submit, f"bqrepl_{uuid.uuid4().hex}")
+            try:
+                rows = self.api.call("result", query_job.result, retry_if=running)
+                break
+            except transient_errors:
+                if query_job.state != "DONE" or (
+                    query_job.statement_type != "SELECT"
+                    or reruns >= self.settings["api_retries"]
+                ):
+                    raise
+            self.api.backoff("query", reruns)
+            reruns += 1
+        self.job_stats.add(query_job)
+        if query_job.statement_type not in (None, "SELECT"):
+            self.invalidate_job_tables(query_job)
+
+        def resume(start_index):
+            return query_job.result(start_index=start_index)
+
+        return query_job, ApiRows(self.api, rows, resume)
+
+    def invalidate_job_tables(self, job):
+        """Drops cached metadata of tables a DDL/DML job may have changed"""
+
+        refs = [job.ddl_target_table, job.destination, *(job.referenced_tables or [])]
+        for ref in filter(None, refs):
+            dataset_id = f"{ref.project}.{ref.dataset_id}"
+            self.metadata.invalidate_table(f"{dataset_id}.{ref.table_id}")
+            self.metadata.invalidate_dataset(dataset_id)
+            self.previews.invalidate(f"{dataset_id}.{ref.table_id}")
 
     def execute_query(self, text):
         """Executes query"""
 
+        text = self.check_select_star(text)
+        if text is None:
+            return
+
         try:
-            query_job = self.client.query(text)
-            if query_job.errors:
-                for err_dict in query_job.errors:
-                    logger.error(err_dict)
-                return
-        except Exception as e:
-            for err_dict in e.args:
+            query_job, result = self.run_query(text)
+        except api_errors as e:
+            for err_dict in error_messages(e):
                 logger.error(err_dict)
             return
 
-        result = query_job.result()
         schema = result.schema
 
-        self.show_results(result, schema, t0=query_job.started)
+        self.show_query_results(result, schema, t0=query_job.started)
+
+    def show_query_results(self, data, schema, **kwargs):
+        """Shows results, reporting errors reading their pages"""
+
+        try:
+            self.show_results(data, schema, **kwargs)
+        except api_errors as e:
+            echo()
+            logger.error("Something went wrong reading the results")
+            for err_dict in error_messages(e):
+                logger.error(err_dict)
+
+    def fanout_query(self, projects, text):
+        """Executes the same query in multiple projects at once"""
+
+        # no more rows than can be displayed are downloaded from any project
+        maxrows = self.resolve_maxrows()
+
+        def run_in_project(project):
+            t0 = time.monotonic()
+            try:
+                client = self.backend.client(
+                    project=project, credentials=self.credentials
+                )
+                query_job, result = self.run_query(text, client=client)
+                rows = [dict(row.items()) for row in islice(result, maxrows)]
+                return (
+                    project, result.schema, rows, result.total_rows, None,
+                    time.monotonic() - t0,
+                )
+            except api_errors as e:
+                return project, None, None, None, e, time.monotonic() - t0
+
+        t0 = datetime.now(tz=pytz.utc)
+        workers = max(1, min(self.settings["fanout_workers"], len(projects)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_in_project, projects))
+
+        Schema = namedtuple("Schema", ["name", "field_type"])
+
+        schema = [Schema("source_project", "STRING")]
+        data = []
+        status = []
+        for project, result_schema, rows, total_rows, error, latency in results:
+            if error is None:
+                for field in result_schema:
+                    if field.name not in [x.name for x in schema]:
+                        schema.append(Schema(field.name, field.field_type))
+                data.extend(dict(row, source_project=project) for row in rows)
+            status.append(
+                dict(
+                    project=project,
+                    status="ok" if error is None else "error",
+                    rows=len(rows) if error is None else None,
+                    total_rows=total_rows,
+                    latency=latency,
+                    error=None if error is None else str(error),
+                )
+            )
+
+        if len(schema) > 1:
+            self.show_results(data, schema, t0=t0)
+
+        status_schema = [
+            Schema("project", "STRING"),
+            Schema("status", "STRING"),
+            Schema("rows", "INTEGER"),
+            Schema("total_rows", "INTEGER"),
+            Schema("latency", "FLOAT"),
+            Schema("error", "STRING"),
+        ]
+        self.show_results(status, status_schema)
 
     def run(self):
         """Waits for commands"""
@@ -642,10 +1464,99 @@ def main(**kwargs):
     bqrepl.run()
 
 
-@click.command(help="REPL for BigQuery")
+@click.group(help="REPL for BigQuery", invoke_without_command=True)
 @click.option("-c", "--credentials-file", help="path to credentials .json")
 @click.option(
     "-p", "--project", help="Use specific project instead of inferring from credentials"
 )
-def cli(**kwargs):
-    main(**kwargs)
+@click.pass_context
+def cli(ctx, **kwargs):
+    if ctx.invoked_subcommand is None:
+        main(**kwargs)
+    ctx.obj = kwargs
+
+
+@cli.command(help="Replay a workload of ;-separated SQL statements")
+@click.argument("workload", type=click.Path(exists=True, dir_okay=False))
+@click.option("-n", "--queries", default=100, help="Number of queries to run")
+@click.option("--concurrency", default=4, help="Queries running at the same time")
+@click.option(
+    "--qps", type=float, help="Submit queries at this rate instead of back to back"
+)
+@click.option("--seed", default=0, help="Seed for picking weighted statements")
+@click.option("--json", "json_path", help="Write summary as JSON to this path")
+@click.option("--fake", is_flag=True, help="Run against in-process fake BigQuery")
+@click.option(
+    "--fake-latency", default=0.1, help="Seconds each query takes on fake BigQuery"
+)
+@click.pass_context
+def bench(ctx, workload, **kwargs):
+    workload = load_workload(workload)
+    if not workload:
+        secho("No statements in workload", fg="red")
+        sys.exit(1)
+
+    if kwargs["fake"]:
+        from bqrepl.fake import FakeBackend
+
+        backend = FakeBackend(query_latency=kwargs["fake_latency"], auto_create=True)
+        project = ctx.obj.get("project") or "fake-project"
+        credentials = None
+    else:
+        bqrepl = BQREPL(
+            credentials_file=ctx.obj.get("credentials_file"),
+            project=ctx.obj.get("project"),
+            check_version=False,
+        )
+        bqrepl.connect_client()
+        backend = bqrepl.backend
+        project = bqrepl.settings["project"]
+        credentials = bqrepl.credentials
+
+    records, wall_time = run_benchmark(
+        lambda: backend.client(project=project, credentials=credentials),
+        workload,
+        queries=kwargs["queries"],
+        concurrency=kwargs["concurrency"],
+        qps=kwargs["qps"],
+        seed=kwargs["seed"],
+    )
+    summary = summarize(records, wall_time)
+
+    def seconds(stats):
+        return "  ".join(
+            f"{k}=" + style(f"{v:.3f}s" if v is not None else "-", fg="bright_black")
+            for k, v in stats.items()
+        )
+
+    echo(
+        f"{summary['queries']:,d} queries, "
+        + style(
+            f"{summary['errors']:,d} errors", fg="red" if summary["errors"] else None
+        )
+        + f" in {summary['wall_time']:.2f}s ({summary['qps']:.2f} qps)"
+    )
+    echo("latency     " + seconds(summary["latency"]))
+    echo("queue time  " + seconds(summary["queue_time"]))
+    echo(
+        f"processed {format_bytes(summary['bytes_processed'])}, "
+        f"billed {format_bytes(summary['bytes_billed'])}, "
+        f"{summary['slot_ms']:,d} slot-ms, {summary['cache_hits']:,d} cache hits"
+    )
+    for sql, stats in summary["per_query"].items():
+        label = " ".join(sql.split())
+        label = label[:60] + "..." if len(label) > 60 else label
+        echo(
+            style(f"{stats['count']:6,d} ", fg="bright_black")
+            + label
+            + "  p50="
+            + style(
+                f"{stats['latency']['p50']:.3f}s"
+                if stats["latency"]["p50"] is not None else "-",
+                fg="bright_black",
+            )
+        )
+
+    if kwargs["json_path"]:
+        with open(kwargs["json_path"], "w") as f:
+            json.dump(summary, f, indent=2)
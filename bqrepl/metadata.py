@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import defaultdict, deque
+
+from google.api_core import exceptions
+from google.cloud import bigquery
+from logzero import logger
+
+from bqrepl.api import ApiClient, api_errors, listed
+
+
+# prefix of ids of the jobs checking for changes, so they can be told apart
+watch_job_prefix = "bqrepl_watch_"
+
+
+def full_id(project, ref, parts_count=3):
+    """Fully qualified table (or dataset, with 2 parts) id, without decorators"""
+    parts = ref.strip("`").split("$")[0].split(".")
+    if len(parts) < parts_count and project:
+        parts = [project] + parts
+    return ".".join(parts)
+
+
+def marker(table):
+    """Last modification time of a table in ms, comparable with `table_markers`"""
+    return round(table.modified.timestamp() * 1000) if table.modified else None
+
+
+def table_markers(client, dataset_id):
+    """Last modification time in ms of every table in a dataset, by table name
+
+    A single `__TABLES__` metadata query covers the whole dataset, its job id
+    starts with `watch_job_prefix`.
+    """
+    sql = f"SELECT table_id, last_modified_time FROM `{dataset_id}.__TABLES__`"
+    job_config = bigquery.QueryJobConfig(use_query_cache=False)
+    rows = client.query(
+        sql, job_config=job_config, job_id_prefix=watch_job_prefix
+    ).result()
+    return {row["table_id"]: row["last_modified_time"] for row in rows}
+
+
+class MetadataCache:
+    """Results of `list_tables` and `get_table`, kept until invalidated
+
+    Calls for the same dataset/table made while one is in flight share its result.
+    """
+
+    def __init__(self, api=None):
+        self.api = api or ApiClient()
+        self._lock = threading.Lock()
+        self._datasets = {}
+        self._tables = {}
+
+    def list_tables(self, client, dataset):
+        dataset_id = full_id(client.project, dataset, parts_count=2)
+        with self._lock:
+            if dataset_id in self._datasets:
+                return self._datasets[dataset_id]
+        tables = self.api.call(
+            "list_tables", listed(client.list_tables), dataset_id, coalesce=True
+        )
+        with self._lock:
+            self._datasets[dataset_id] = tables
+        return tables
+
+    def get_table(self, client, table):
+        table_id = full_id(client.project, table)
+        with self._lock:
+            if table_id in self._tables:
+                return self._tables[table_id]
+        result = self.api.call(
+            "get_table", client.get_table, table_id, coalesce=True
+        )
+        with self._lock:
+            self._tables[table_id] = result
+        return result
+
+    def cached(self):
+        """Snapshot of cached entries: {dataset_id: tables}, {table_id: table}"""
+        with self._lock:
+            return dict(self._datasets), dict(self._tables)
+
+    def invalidate_dataset(self, dataset_id):
+        with self._lock:
+            self._datasets.pop(dataset_id, None)
+
+    def invalidate_table(self, table_id):
+        with self._lock:
+            self._tables.pop(table_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._datasets.clear()
+            self._tables.clear()
+
+
+class SchemaWatcher:
+    """Background thread dropping cached metadata of datasets/tables that changed
+
+    Every `metadata_refresh_interval` seconds each dataset with cached entries
+    is checked with a single call reading modification times of all of its
+    tables, which are compared with the cached tables and table lists.
+    At most `metadata_refresh_budget` API calls (one per dataset) are made per
+    minute, datasets that didn't fit in the budget are checked first in the next
+    round.
+
+    settings: dict with `metadata_refresh_interval` and `metadata_refresh_budget`,
+        read on every round so changes apply right away
+    get_client: callable returning the client to use
+    on_change: callable getting the id of every invalidated dataset/table
+    api: `ApiClient` making the calls, the one of the cache by default
+    """
+
+    def __init__(self, cache, settings, get_client, on_change=None, api=None):
+        self.cache = cache
+        self.api = api or cache.api
+        self.settings = settings
+        self.get_client = get_client
+        self.on_change = on_change
+        self.checks = 0
+        self._calls = deque()
+        self._queue = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _allow_call(self):
+        now = time.monotonic()
+        while self._calls and self._calls[0] <= now - 60:
+            self._calls.popleft()
+        if len(self._calls) >= self.settings["metadata_refresh_budget"]:
+            return False
+        self._calls.append(now)
+        return True
+
+    def _changed(self, entity_id):
+        logger.debug(f"Metadata of {entity_id} changed")
+        if self.on_change is not None:
+            self.on_change(entity_id)
+
+    def _check_dataset(self, client, dataset_id, tables, cached_tables):
+        try:
+            markers = self.api.call(
+                "table_markers", table_markers, client, dataset_id, coalesce=True
+            )
+        except exceptions.NotFound:
+            markers = {}
+        if tables is not None and set(markers) != {t.table_id for t in tables}:
+            self.cache.invalidate_dataset(dataset_id)
+            self._changed(dataset_id)
+        for table_id, table in cached_tables.items():
+            if markers.get(table_id.rsplit(".", 1)[1]) != marker(table):
+                self.cache.invalidate_table(table_id)
+                self._changed(table_id)
+
+    def check(self):
+        """Runs a single round of checks, within the API call budget"""
+        client = self.get_client()
+        if client is None:
+            return
+        datasets, tables = self.cache.cached()
+        tables_by_dataset = defaultdict(dict)
+        for table_id, table in tables.items():
+            tables_by_dataset[table_id.rsplit(".", 1)[0]][table_id] = table
+        entries = list(dict.fromkeys([*datasets, *tables_by_dataset]))
+        # unchecked leftovers of the previous round go first
+        pending = [e for e in self._queue if e in entries]
+        self._queue = pending + [e for e in entries if e not in pending]
+
+        while self._queue and self._allow_call():
+            dataset_id = self._queue.pop(0)
+            self.checks += 1
+            self._check_dataset(
+                client, dataset_id, datasets.get(dataset_id),
+                tables_by_dataset.get(dataset_id, {}),
+            )
+
+    def _run(self):
+        while not self._stop.wait(self.settings["metadata_refresh_interval"] or 1):
+            if not self.settings["metadata_refresh_interval"]:
+                continue
+            try:
+                self.check()
+            except api_errors as e:
+                logger.debug(f"Checking metadata failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
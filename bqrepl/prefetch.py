@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+
+_PAGE = "page"
+_DONE = "done"
+_ERROR = "error"
+
+
+class PrefetchIterator:
+    """Iterates over rows while the next pages are fetched on a worker thread
+
+    Wraps the `pages` of a `RowIterator`. Up to `depth` fetched pages are kept
+    waiting in a bounded queue, so the worker stops fetching (and memory stays
+    bounded) when formatting falls behind. With `limit` the worker also stops
+    once that many rows were fetched, until the limit is raised with
+    `set_limit` or rows past it are asked for.
+    """
+
+    def __init__(self, pages, depth=1, total_rows=None, schema=None, limit=None):
+        self.total_rows = total_rows
+        self.schema = schema
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._limit = limit
+        self._fetched = 0
+        self._consumed = 0
+        self._more = threading.Condition()
+        self._rows = []
+        self._index = 0
+        self._done = False
+        self._error = None
+        self._thread = threading.Thread(target=self._fetch, args=(pages,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """Blocks until there's room in the queue, unless iterator got closed"""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def set_limit(self, limit):
+        """Lets the worker fetch pages until `limit` rows in total were fetched"""
+        with self._more:
+            self._limit = limit
+            self._more.notify_all()
+
+    def _under_limit(self):
+        """Blocks while the limit is reached, False if iterator got closed"""
+        with self._more:
+            while (
+                self._limit is not None
+                and self._fetched >= self._limit
+                and not self._stop.is_set()
+            ):
+                self._more.wait()
+        return not self._stop.is_set()
+
+    def _demand(self):
+        """Raises the limit when rows past it are needed, so they get fetched"""
+        if self._limit is not None and self._consumed >= self._limit:
+            self.set_limit(self._consumed + 1)
+
+    def _fetch(self, pages):
+        pages = iter(pages)
+        try:
+            while self._under_limit():
+                try:
+                    page = list(next(pages))
+                except StopIteration:
+                    break
+                with self._more:
+                    self._fetched += len(page)
+                if not self._put((_PAGE, page)):
+                    return
+            else:
+                return
+        except Exception as e:
+            self._put((_ERROR, e))
+            return
+        self._put((_DONE, None))
+
+    def _load(self, timeout=None):
+        """Takes the next fetched page, False if none arrived within `timeout`"""
+        try:
+            kind, payload = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if kind == _PAGE:
+            self._rows = payload
+            self._index = 0
+        else:
+            self._done = True
+            self._error = payload
+        return True
+
+    def wait(self, timeout):
+        """Waits up to `timeout` seconds for the next row to be available
+
+        Returns True when `next()` won't block.
+        """
+        while self._index >= len(self._rows) and not self._done:
+            self._demand()
+            if not self._load(timeout=max(0, timeout)):
+                return False
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._index >= len(self._rows):
+            if self._done:
+                error, self._error = self._error, None
+                if error is not None:
+                    raise error
+                raise StopIteration
+            self._demand()
+            self._load()
+        row = self._rows[self._index]
+        self._index += 1
+        self._consumed += 1
+        return row
+
+    def close(self):
+        """Stops the worker thread and drops any buffered pages"""
+        self._stop.set()
+        with self._more:
+            self._more.notify_all()
+        self._done = True
+        self._rows = []
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def rows_before(data, deadline):
+    """Yields rows from `data` until `deadline` (as in `time.monotonic()`) passes
+
+    Rows still being fetched by a `PrefetchIterator` aren't waited for past the
+    deadline.
+    """
+    rows = iter(data)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if isinstance(rows, PrefetchIterator) and not rows.wait(remaining):
+            return
+        try:
+            yield next(rows)
+        except StopIteration:
+            return
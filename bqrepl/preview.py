@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from bqrepl.api import ApiClient, listed
+
+
+def fetch_preview(
+    client, table_id, max_results, fields=None, get_table=None, api=None
+):
+    """Reads first rows of a table with tabledata.list, no query job involved
+
+    Returns table metadata and the rows, with only `fields` columns if given.
+    Partition decorators (`table$20210101`) are passed through to list_rows.
+    Table metadata is read with `get_table` if given, e.g. to use a cache.
+    Calls are made through `api`, an `ApiClient`, if given.
+    """
+    api = api or ApiClient()
+    if get_table is None:
+        def get_table(t):
+            return api.call("get_table", client.get_table, t, coalesce=True)
+
+    table = get_table(table_id.split("$")[0])
+    schema = table.schema
+    if fields:
+        unknown = [f for f in fields if f not in [x.name for x in schema]]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        schema = [x for x in schema if x.name in fields]
+    rows = api.call(
+        "list_rows", listed(client.list_rows), table_id,
+        selected_fields=schema, max_results=max_results,
+    )
+    return table, rows
+
+
+class PreviewCache:
+    """Previews of tables the user is likely to open next, fetched in background
+
+    get_table: reads table metadata for the previews, e.g. from a cache
+    """
+
+    def __init__(self, size=32, workers=2, api=None, get_table=None):
+        self.api = api
+        self.get_table = get_table
+        self.size = size
+        self.workers = workers
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def prefetch(self, client, table_id, max_results):
+        """Starts fetching all columns of the table unless it's already cached"""
+        with self._lock:
+            entry = self._entries.get(table_id)
+            if entry is not None and entry[0] >= max_results:
+                return entry[1]
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            future = self._pool.submit(
+                fetch_preview, client, table_id, max_results,
+                get_table=self.get_table, api=self.api,
+            )
+            self._entries[table_id] = (max_results, future)
+            self._entries.move_to_end(table_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return future
+
+    def get(self, table_id, max_results):
+        """Future with the cached preview, None if there isn't one big enough"""
+        with self._lock:
+            entry = self._entries.get(table_id)
+            if entry is None or entry[0] < max_results:
+                return None
+            self._entries.move_to_end(table_id)
+            return entry[1]
+
+    def invalidate(self, table_id=None):
+        """Drops the cached preview of a table, or all of them"""
+        with self._lock:
+            if table_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k.split("$")[0] == table_id]:
+                    del self._entries[key]
@@ -0,0 +1,87 @@
+"""Suggestions for cheaper versions of `SELECT *` queries"""
+import re
+
+from google.cloud import bigquery
+
+select_star_re = re.compile(
+    r"^\s*select\s+\*\s+from\s+(?P<table>`[^`]+`|[\w\-.$]+)"
+    r"(?:\s+where\s+(?P<where>.+?))?"
+    r"(?P<tail>\s+(?:order\s+by|limit)\s+.+?)?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# rough display width of values, for columns that will fit the screen
+type_widths = {
+    "INTEGER": 9,
+    "INT64": 9,
+    "FLOAT": 12,
+    "FLOAT64": 12,
+    "BOOLEAN": 5,
+    "BOOL": 5,
+    "DATE": 10,
+    "DATETIME": 26,
+    "TIMESTAMP": 25,
+    "TIME": 15,
+}
+
+
+def parse_select_star(sql):
+    """Table, where clause and rest of a plain `SELECT * FROM table` query
+
+    Queries with parentheses after the table are left alone, the `LIMIT` or
+    `ORDER BY` that ends the where clause could belong to a subquery.
+    """
+    match = select_star_re.match(sql)
+    if not match:
+        return None
+    table, where, tail = match.group("table", "where", "tail")
+    if re.search(r"[()]", (where or "") + (tail or "")):
+        return None
+    return table.strip("`"), where, tail
+
+
+def displayed_columns(schema, width, maxwidth):
+    """Names of leading columns that fit in `width` characters of the table view"""
+    columns = []
+    # row number column
+    used = 6
+    for field in schema:
+        value_width = type_widths.get(field.field_type, maxwidth)
+        used += max(len(field.name), len(field.field_type), value_width) + 3
+        if used > width and columns:
+            break
+        columns.append(field.name)
+    return columns
+
+
+def partition_filter(table):
+    """Condition reading only today's partition of a time partitioned table"""
+    partitioning = table.time_partitioning
+    if partitioning is None:
+        return None
+    if not partitioning.field:
+        return "_PARTITIONDATE = CURRENT_DATE()"
+    field_type = {f.name: f.field_type for f in table.schema}.get(partitioning.field)
+    if field_type == "DATE":
+        return f"`{partitioning.field}` = CURRENT_DATE()"
+    return f"DATE(`{partitioning.field}`) = CURRENT_DATE()"
+
+
+def rewrite(sql, columns=None, condition=None):
+    """Query projecting only `columns` and/or filtered with `condition`"""
+    table, where, tail = parse_select_star(sql)
+    projection = ", ".join(f"`{c}`" for c in columns) if columns else "*"
+    rewritten = f"SELECT {projection}\nFROM `{table}`"
+    if where and condition:
+        rewritten += f"\nWHERE ({where}) AND {condition}"
+    elif where or condition:
+        rewritten += f"\nWHERE {where or condition}"
+    if tail:
+        rewritten += "\n" + tail.strip()
+    return rewritten
+
+
+def dry_run_bytes(client, sql):
+    """Bytes the query would process, according to a dry run"""
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    return client.query(sql, job_config=job_config).total_bytes_processed
@@ -0,0 +1,106 @@
+"""Outputs for results of `BQREPL.query`
+
+Arrow and pandas sinks hand the row iterator over to google-cloud-bigquery's
+columnar readers (the BigQuery Storage API when it's installed), so rows never
+become `Row` objects or per-cell dicts on the way. pyarrow and pandas are only
+imported when such a sink is used.
+"""
+
+# sink name -> sink(handle, **kwargs)
+sinks = {}
+
+
+def sink(name):
+    """Registers a function consuming a `ResultHandle` as a named sink"""
+
+    def register(consume):
+        sinks[name] = consume
+        return consume
+
+    return register
+
+
+def require(module, purpose):
+    """Imports an optional dependency, with a hint on how to get it"""
+    try:
+        return __import__(module)
+    except ImportError as e:
+        raise ImportError(
+            f"{purpose} needs {module}, install it with `pip install {module}`"
+        ) from e
+
+
+class ResultHandle:
+    """Finished query job whose rows can be read once, by any sink
+
+    job: the query job
+    rows: its row iterator, fetching pages lazily
+    """
+
+    def __init__(self, repl, job, rows):
+        self.repl = repl
+        self.job = job
+        self.rows = rows
+        self._consumed = False
+
+    @property
+    def schema(self):
+        return self.rows.schema
+
+    @property
+    def total_rows(self):
+        return self.rows.total_rows
+
+    def to(self, name, **kwargs):
+        """Reads the rows into the sink registered as `name`"""
+        if name not in sinks:
+            raise ValueError(
+                f"Unknown sink {name}, available: {', '.join(sorted(sinks))}"
+            )
+        if self._consumed:
+            raise ValueError("Rows of this result were already read")
+        self._consumed = True
+        return sinks[name](self, **kwargs)
+
+    def show(self):
+        return self.to("terminal")
+
+    def to_arrow(self, **kwargs):
+        return self.to("arrow", **kwargs)
+
+    def to_dataframe(self, **kwargs):
+        return self.to("pandas", **kwargs)
+
+    def record_batches(self, **kwargs):
+        return self.to("record_batches", **kwargs)
+
+
+@sink("terminal")
+def terminal_sink(handle):
+    """Prints rows the way the REPL does, with current settings"""
+    handle.repl.show_results(handle.rows, handle.schema, t0=handle.job.started)
+
+
+@sink("arrow")
+def arrow_sink(handle, **kwargs):
+    """`pyarrow.Table` with all rows, kwargs go to `RowIterator.to_arrow`"""
+    require("pyarrow", "Arrow output")
+    return handle.rows.to_arrow(**kwargs)
+
+
+@sink("pandas")
+def pandas_sink(handle, **kwargs):
+    """`pandas.DataFrame` with all rows, kwargs go to `RowIterator.to_dataframe`"""
+    require("pyarrow", "DataFrame output")
+    require("pandas", "DataFrame output")
+    return handle.rows.to_dataframe(**kwargs)
+
+
+@sink("record_batches")
+def record_batches_sink(handle, **kwargs):
+    """Iterator of `pyarrow.RecordBatch`es, one per page of results
+
+    kwargs go to `RowIterator.to_arrow_iterable`, e.g. `bqstorage_client`.
+    """
+    require("pyarrow", "Record batch output")
+    return handle.rows.to_arrow_iterable(**kwargs)
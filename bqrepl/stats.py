@@ -0,0 +1,79 @@
+from collections import deque
+
+
+def format_bytes(n):
+    """Human readable size, e.g. 1.5 GiB"""
+    if n is None:
+        return None
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(n) < 1024 or unit == "TiB":
+            break
+        n /= 1024
+    return f"{n:,.0f} {unit}" if unit == "B" else f"{n:,.1f} {unit}"
+
+
+def plan_stages(query_job):
+    """Per-stage breakdown of the query plan"""
+    stages = []
+    for entry in query_job.query_plan or []:
+        compute_avg = entry.compute_ratio_avg
+        stages.append(
+            dict(
+                stage=entry.name,
+                status=entry.status,
+                wait_avg=entry.wait_ratio_avg,
+                wait_max=entry.wait_ratio_max,
+                read_avg=entry.read_ratio_avg,
+                read_max=entry.read_ratio_max,
+                compute_avg=compute_avg,
+                compute_max=entry.compute_ratio_max,
+                write_avg=entry.write_ratio_avg,
+                write_max=entry.write_ratio_max,
+                # slowest worker compared to an average one
+                skew=(
+                    entry.compute_ratio_max / compute_avg
+                    if compute_avg and entry.compute_ratio_max is not None
+                    else None
+                ),
+                records_read=entry.records_read,
+                records_written=entry.records_written,
+                shuffle_bytes=entry.shuffle_output_bytes,
+                shuffle_spilled=entry.shuffle_output_bytes_spilled,
+                slot_ms=entry.slot_ms,
+            )
+        )
+    return stages
+
+
+def job_stats(query_job):
+    """Statistics worth keeping once a query job is done"""
+    started, ended = query_job.started, query_job.ended
+    return dict(
+        job_id=query_job.job_id,
+        project=query_job.project,
+        query=query_job.query,
+        started=started,
+        duration=(ended - started).total_seconds() if started and ended else None,
+        bytes_processed=query_job.total_bytes_processed,
+        bytes_billed=query_job.total_bytes_billed,
+        slot_ms=query_job.slot_millis,
+        cache_hit=query_job.cache_hit,
+        stages=plan_stages(query_job),
+    )
+
+
+class JobStatsStore:
+    """Statistics of the queries run in this session, most recent last"""
+
+    def __init__(self, size=100):
+        self._jobs = deque(maxlen=size)
+
+    def add(self, query_job):
+        self._jobs.append(job_stats(query_job))
+
+    def last(self, n=1):
+        """Up to `n` most recent entries, most recent first"""
+        return list(reversed(self._jobs))[:n]
+
+    def __len__(self):
+        return len(self._jobs)
@@ -0,0 +1,25 @@
+import pytest
+
+from bqrepl.fake import FakeBackend
+from bqrepl.main import BQREPL
+
+
+@pytest.fixture
+def make_bqrepl():
+    """Factory of connected `BQREPL`s in project `proj`, backed by a fake
+
+    tables: {table_id: `FakeBackend.add_table` keyword arguments}
+    settings: settings to change from the defaults
+    Other keyword arguments go to `FakeBackend`. Returns the REPL and backend.
+    """
+
+    def make(tables=None, settings=None, **backend_kwargs):
+        backend = FakeBackend(**backend_kwargs)
+        for table_id, table in (tables or {}).items():
+            backend.add_table(table_id, **table)
+        bqrepl = BQREPL(project="proj", backend=backend, check_version=False)
+        bqrepl.settings.update(settings or {})
+        bqrepl.connect_client()
+        return bqrepl, backend
+
+    return make
@@ -0,0 +1,272 @@
+import threading
+import time
+
+import pytest
+import requests
+from google.api_core import exceptions
+
+from bqrepl.api import ApiClient, TokenBucket, existing_job
+from bqrepl.fake import FakeBackend
+
+
+def make_api(**settings):
+    sleeps = []
+    api = ApiClient(
+        dict(api_retries=3, api_backoff_ms=100, api_rate_limit=0, **settings),
+        sleep=sleeps.append,
+    )
+    return api, sleeps
+
+
+def failing(*errors):
+    errors = list(errors)
+
+    def call(value):
+        if errors:
+            raise errors.pop(0)
+        return value
+
+    return call
+
+
+def test_retries_transient_errors_with_backoff():
+    api, sleeps = make_api()
+
+    result = api.call("m", failing(
+        exceptions.ServiceUnavailable("busy"), exceptions.TooManyRequests("slow down"),
+    ), 42)
+
+    assert result == 42
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.1 and 0 <= sleeps[1] <= 0.2
+    assert api.stats()["m"]["calls"] == 3
+    assert api.stats()["m"]["retries"] == 2
+
+
+def test_retries_network_errors():
+    api, sleeps = make_api()
+
+    result = api.call("m", failing(
+        requests.exceptions.ConnectionError("connection reset"),
+        requests.exceptions.ReadTimeout("read timed out"),
+    ), 42)
+
+    assert result == 42
+    assert api.stats()["m"]["retries"] == 2
+
+
+def test_gives_up_after_retries_and_on_other_errors():
+    api, sleeps = make_api()
+
+    with pytest.raises(exceptions.ServiceUnavailable):
+        api.call("m", failing(*[exceptions.ServiceUnavailable("busy")] * 4), 1)
+    with pytest.raises(exceptions.NotFound):
+        api.call("n", failing(exceptions.NotFound("nope")), 1)
+
+    stats = api.stats()
+    assert (stats["m"]["calls"], stats["m"]["failures"]) == (4, 1)
+    assert (stats["n"]["calls"], stats["n"]["retries"]) == (1, 0)
+
+
+def test_coalesces_identical_calls_in_flight():
+    api, sleeps = make_api()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return [value]
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(api.call("m", slow, "a", coalesce=True))
+        )
+        for _ in range(3)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    while api.stats()["m"]["coalesced"] < 2:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert calls == ["a"]
+    assert results == [["a"]] * 3
+    assert api.call("m", lambda v: [v, v], "a", coalesce=True) == ["a", "a"]
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(50)
+
+    t0 = time.monotonic()
+    waits = [bucket.acquire() for _ in range(60)]
+
+    assert waits[:50] == [0.0] * 50
+    assert all(w > 0 for w in waits[50:])
+    assert time.monotonic() - t0 >= 0.15
+
+
+def test_existing_job_found_in_its_location():
+    backend = FakeBackend()
+    backend.add_dataset("proj.tokyo", location="asia-northeast1")
+    backend.add_table("proj.tokyo.t", [("id", "INTEGER")])
+    client = backend.client("proj")
+    client.query("select id from tokyo.t", job_id="job1")
+
+    with pytest.raises(exceptions.Conflict) as conflict:
+        client.query("select id from tokyo.t", job_id="job1")
+    with pytest.raises(exceptions.NotFound):
+        client.get_job("job1")
+
+    assert existing_job(client, "job1", conflict.value).job_id == "job1"
+
+
+def test_commands_survive_transient_errors(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(settings={"api_backoff_ms": 0})
+    backend.add_dataset("proj.ds")
+    backend.fail("list_datasets", exceptions.ServiceUnavailable("busy"), 2)
+
+    bqrepl.execute_command(r"\d")
+    assert "ds" in capsys.readouterr().out
+
+    bqrepl.execute_command(r"\stats api")
+    out = capsys.readouterr().out
+    row = next(line for line in out.splitlines() if "list_datasets" in line)
+    assert [x.strip() for x in row.split("|")][2:5] == ["3", "2", "0"]
+
+
+def test_permanent_errors_are_not_retried(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl()
+    backend.fail("get_table", exceptions.Forbidden("denied"), 1)
+
+    bqrepl.execute_command(r"\c ds.t")
+
+    assert backend.calls["get_table"] == 1
+
+
+def test_statements_run_once_despite_errors(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=2)},
+        settings={"api_backoff_ms": 0},
+    )
+    backend.fail("result", exceptions.ServiceUnavailable("busy"), 2)
+
+    bqrepl.execute_query("alter table ds.t add column c STRING")
+
+    # waiting for the job was retried, not the statement
+    assert len(backend.jobs) == 1
+    assert bqrepl.api.stats()["result"]["retries"] == 2
+
+    # the job got created, but its submission seemed to fail
+    submit = backend.client("proj").query
+    job_ids = []
+
+    def query(*args, job_id=None, **kwargs):
+        job_ids.append(job_id)
+        if len(job_ids) == 1:
+            submit(*args, job_id=job_id, **kwargs)
+            raise exceptions.ServiceUnavailable("busy")
+        return submit(*args, job_id=job_id, **kwargs)
+
+    bqrepl.client.query = query
+    bqrepl.execute_query("drop table ds.t")
+
+    assert job_ids[0] == job_ids[1]
+    assert len(backend.jobs) == 2
+    assert "proj.ds.t" not in backend.tables
+    assert backend.calls["get_job"] == 1
+
+
+def test_failed_jobs_are_not_polled_again(make_bqrepl, capsys, caplog):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=2)},
+        settings={"api_backoff_ms": 0},
+    )
+    backend.fail("job", exceptions.InternalServerError("backendError"), 1)
+
+    bqrepl.execute_query("select id from ds.t")
+
+    # the query ran again as a new job
+    assert "2/2" in capsys.readouterr().out
+    assert len(backend.jobs) == 2
+    assert backend.calls["result"] == 2
+    assert bqrepl.api.stats()["query"]["retries"] == 1
+    assert bqrepl.api.stats()["result"]["retries"] == 0
+
+    backend.fail("job", exceptions.InternalServerError("backendError"), 1)
+    bqrepl.execute_query("alter table ds.t add column c STRING")
+
+    # other statements aren't, their job may have changed data before failing
+    assert len(backend.jobs) == 3
+    assert backend.calls["result"] == 3
+    assert "backendError" in caplog.text
+
+
+def test_load_calls_are_counted(make_bqrepl, tmp_path, capsys):
+    bqrepl, backend = make_bqrepl()
+    (tmp_path / "a.jsonl").write_text('{"id": 1}\n')
+
+    bqrepl.execute_command(rf"\load {tmp_path}/a.jsonl ds.t")
+    bqrepl.execute_command(r"\stats api")
+
+    out = capsys.readouterr().out
+    assert "load_chunk" in out
+    assert "get_table" in out
+
+
+def fail_page(backend, number, error):
+    """Makes the `number`th page fetched from now on fail with `error`"""
+    page = backend.page
+    fetched = backend.calls["page"]
+
+    def failing_page():
+        if backend.calls["page"] == fetched + number - 1:
+            backend.fail("page", error, 1)
+        page()
+
+    backend.page = failing_page
+
+
+def test_result_pages_are_read_through_the_api(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=30)},
+        settings={"api_backoff_ms": 0}, page_size=10,
+    )
+    fail_page(backend, 2, exceptions.ServiceUnavailable("busy"))
+
+    bqrepl.execute_query("select id from ds.t")
+    bqrepl.execute_command(r"\stats api")
+
+    # the failed page was read again, without rereading the first one
+    out = capsys.readouterr().out
+    assert "30/30" in out
+    assert f" {29:3,d}" in out
+    assert bqrepl.api.stats()["page"]["retries"] == 1
+    assert backend.calls["page"] == 4
+    assert "page" in out
+
+    fail_page(backend, 1, exceptions.ServiceUnavailable("busy"))
+    bqrepl.execute_command(r"\fanout proj select id from ds.t")
+
+    assert "30/30" in capsys.readouterr().out
+    assert bqrepl.api.stats()["page"]["retries"] == 2
+
+
+def test_result_page_errors_are_reported(make_bqrepl, capsys, caplog):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=30)},
+        page_size=10,
+    )
+    fail_page(backend, 2, exceptions.Forbidden("no access"))
+
+    bqrepl.execute_query("select id from ds.t")
+
+    assert "no access" in caplog.text
+    assert bqrepl.api.stats()["page"]["failures"] == 1
@@ -0,0 +1,64 @@
+import json
+
+from click.testing import CliRunner
+
+from bqrepl.bench import load_workload, percentile, run_benchmark, summarize
+from bqrepl.fake import FakeBackend
+from bqrepl.main import cli
+
+workload_sql = """
+-- weight: 3
+SELECT * FROM ds.events LIMIT 10;
+SELECT id, name FROM ds.events;
+"""
+
+
+def test_load_workload(tmp_path):
+    path = tmp_path / "workload.sql"
+    path.write_text(workload_sql)
+
+    assert load_workload(path) == [
+        ("SELECT * FROM ds.events LIMIT 10", 3.0),
+        ("SELECT id, name FROM ds.events", 1.0),
+    ]
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(101)), 99) == 99
+
+
+def test_run_benchmark_concurrently():
+    backend = FakeBackend(query_latency=0.05, auto_create=True)
+    workload = [("SELECT * FROM ds.events", 1), ("SELECT nope FROM ds.events", 1)]
+
+    records, wall_time = run_benchmark(
+        lambda: backend.client(project="proj"), workload, queries=16, concurrency=8
+    )
+    summary = summarize(records, wall_time)
+
+    assert summary["queries"] == 16
+    assert 0 < summary["errors"] < 16
+    assert summary["latency"]["p50"] >= 0.05
+    # run one by one, the queries would take as long as their latencies add up
+    # to, on 8 workers they overlap whatever the latencies are
+    assert wall_time < sum(r["latency"] for r in records) / 2
+    assert summary["per_query"]["SELECT * FROM ds.events"]["bytes_processed"] > 0
+
+
+def test_bench_command(tmp_path):
+    path = tmp_path / "workload.sql"
+    path.write_text(workload_sql)
+    json_path = tmp_path / "summary.json"
+
+    result = CliRunner().invoke(
+        cli,
+        ["bench", str(path), "--fake", "--fake-latency", "0", "-n", "10",
+         "--qps", "100", "--json", str(json_path)],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "10 queries, 0 errors" in result.output
+    assert json.loads(json_path.read_text())["queries"] == 10
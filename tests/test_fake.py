@@ -0,0 +1,87 @@
+import pytest
+from google.api_core import exceptions
+from google.cloud import bigquery
+
+from bqrepl.fake import FakeBackend
+from bqrepl.main import BQREPL
+
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend(page_size=10)
+    backend.add_table(
+        "proj.ds.events",
+        [("id", "INTEGER"), ("name", "STRING"), ("ts", "TIMESTAMP")],
+        num_rows=25,
+    )
+    return backend
+
+
+def test_fake_query_pages_and_statistics(backend):
+    client = backend.client(project="proj")
+    job = client.query("SELECT id, name FROM `proj.ds.events`")
+    result = job.result()
+
+    assert [f.name for f in result.schema] == ["id", "name"]
+    assert result.total_rows == 25
+    assert [len(page) for page in result.pages] == [10, 10, 5]
+    assert job.total_bytes_processed == 25 * (8 + 16)
+    assert not job.cache_hit
+    assert len(job.query_plan) == 3
+
+    assert client.query("SELECT id, name FROM `proj.ds.events`").cache_hit
+
+
+def test_fake_rows_are_deterministic(backend):
+    client = backend.client(project="proj")
+    first = [tuple(r.values()) for r in client.list_rows("ds.events", max_results=5)]
+    second = [tuple(r.values()) for r in client.query(
+        "select * from ds.events limit 5").result()]
+
+    assert first == second
+
+
+def test_fake_injected_errors_and_dry_run(backend):
+    client = backend.client(project="proj")
+    backend.fail("list_tables", exceptions.ServiceUnavailable("try again"))
+
+    with pytest.raises(exceptions.ServiceUnavailable):
+        client.list_tables("ds")
+    assert [t.table_id for t in client.list_tables("ds")] == ["events"]
+
+    with pytest.raises(exceptions.NotFound):
+        client.get_table("ds.missing")
+
+    config = bigquery.QueryJobConfig(dry_run=True)
+    job = client.query("select id from ds.events", job_config=config)
+    assert job.total_bytes_processed == 25 * 8
+    assert backend.jobs == []
+
+
+def test_fanout_combines_projects(backend, capsys):
+    backend.add_table("other.ds.events", [("id", "INTEGER")], rows=[(1,), (2,)])
+    bqrepl = BQREPL(project="proj", backend=backend, check_version=False)
+    bqrepl.connect_client()
+
+    bqrepl.execute_command(r"\fanout proj,other,missing select id from ds.events")
+    out = capsys.readouterr().out
+
+    assert "27/27" in out
+    assert "404 Not found: Table missing.ds.events" in out
+
+
+def test_fanout_caps_rows_per_project(backend, capsys):
+    backend.add_table("other.ds.events", [("id", "INTEGER")], num_rows=1000)
+    bqrepl = BQREPL(project="proj", backend=backend, check_version=False)
+    bqrepl.connect_client()
+    bqrepl.settings["maxrows"] = 5
+
+    bqrepl.execute_command(r"\fanout proj,other select id from ds.events")
+    out = capsys.readouterr().out
+
+    status = [line for line in out.splitlines() if "| ok" in line]
+    assert [[x.strip() for x in line.split("|")[3:5]] for line in status] == [
+        ["5", "25"], ["5", "1,000"],
+    ]
+    # the first page is enough for 5 rows
+    assert backend.calls["page"] == 2
@@ -0,0 +1,72 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytz
+
+import pytest
+
+from bqrepl.formatters import check_format, get_formatter
+
+settings = {
+    "format_integer": ",d",
+    "format_float": ",.2f",
+    "format_numeric": "default",
+    "format_timestamp": "iso",
+    "format_date": "iso",
+    "format_bytes": "base64",
+    "maxwidth": 10,
+}
+
+
+def test_number_formatters():
+    assert get_formatter("INTEGER", settings)(1234) == "1,234"
+    assert get_formatter("FLOAT", settings)(1234.5) == "1,234.50"
+    assert get_formatter("NUMERIC", settings)(Decimal("1.50")) == "1.50"
+    numeric = get_formatter("NUMERIC", dict(settings, format_numeric=",.1f"))
+    assert numeric(Decimal("1234.56")) == "1,234.6"
+
+
+def test_temporal_formatters():
+    ts = datetime(2021, 5, 30, 14, 44, 47, tzinfo=pytz.utc)
+    timestamp = get_formatter(
+        "TIMESTAMP", dict(settings, format_timestamp="%Y-%m-%d", maxwidth=None)
+    )
+
+    assert timestamp(ts) == "2021-05-30"
+    # microseconds since epoch
+    assert timestamp(1622385887000000) == "2021-05-30"
+    assert get_formatter("DATE", settings)(date(2021, 1, 2)) == "2021-01-02"
+    assert get_formatter("TIMESTAMP", settings)(ts) == "2021-05-30..."
+
+
+def test_bytes_formatter():
+    data = bytes(range(100))
+
+    assert get_formatter("BYTES", dict(settings, maxwidth=None))(b"\x00\xff") == "AP8="
+    assert get_formatter("BYTES", settings)(data) == "AAECAwQF..."
+    assert get_formatter("BYTES", dict(settings, format_bytes="hex"))(data) == (
+        "0001020304..."
+    )
+    assert get_formatter("BYTES", settings)(b"\x00") == "AA=="
+    # the expanded view doesn't truncate, but still only encodes the start
+    expanded = dict(settings, maxwidth=None, max_expanded_width=4, format_bytes="hex")
+    assert get_formatter("BYTES", expanded)(bytes(1000)) == "00" * 20 + "..."
+    with pytest.raises(ValueError):
+        get_formatter("BYTES", dict(settings, format_bytes="base32"))
+
+
+def test_check_format():
+    check_format("format_numeric", ",.2f", settings)
+    check_format("format_date", "%d/%m/%Y", settings)
+    check_format("maxwidth", "anything", settings)
+    with pytest.raises(ValueError, match="NUMERIC"):
+        check_format("format_numeric", "xyz", settings)
+    with pytest.raises(ValueError, match="INTEGER"):
+        check_format("format_integer", ".2s", settings)
+    with pytest.raises(ValueError, match="BYTES"):
+        check_format("format_bytes", "base32", settings)
+
+
+def test_unknown_types_formatted_as_strings():
+    assert get_formatter("GEOGRAPHY", settings)("POINT(1 2)") == "POINT(1 2)"
+    assert get_formatter("STRING", settings)("a" * 20) == "a" * 10 + "..."
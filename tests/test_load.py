@@ -0,0 +1,185 @@
+import pytest
+from google.api_core import exceptions
+from google.cloud import bigquery
+
+from bqrepl.api import ApiClient
+from bqrepl.fake import FakeBackend
+from bqrepl.load import ChunkReader, load_files, parse_schema, split_file
+
+
+def write_csv(path, rows):
+    path.write_text("id,name,score\n" + "".join(
+        f"{i},name {i},{i / 2}\n" for i in range(rows)
+    ))
+    return str(path)
+
+
+def make_api():
+    return ApiClient(
+        dict(api_retries=3, api_backoff_ms=0, api_rate_limit=0),
+        sleep=lambda delay: None,
+    )
+
+
+def test_split_file_at_line_ends(tmp_path):
+    path = write_csv(tmp_path / "data.csv", 100)
+
+    chunks = split_file(path, 200, bigquery.SourceFormat.CSV)
+
+    assert len(chunks) > 5
+    assert [c.first for c in chunks] == [True] + [False] * (len(chunks) - 1)
+    data = open(path, "rb").read()
+    for chunk in chunks:
+        assert data[chunk.start + chunk.length - 1:][:1] == b"\n"
+    assert "".join(
+        ChunkReader(c).read().decode() for c in chunks
+    ) == data.decode()
+
+
+def test_chunk_reader_counts_bytes_once(tmp_path):
+    path = write_csv(tmp_path / "data.csv", 10)
+    chunk = split_file(path, 1000, bigquery.SourceFormat.CSV)[0]
+    read = []
+    reader = ChunkReader(chunk, on_read=read.append)
+
+    reader.read(10)
+    reader.seek(0)
+    reader.read()
+    reader.close()
+
+    assert sum(read) == chunk.length
+
+
+def test_load_files_in_chunks(tmp_path):
+    backend = FakeBackend()
+    client = backend.client("proj")
+    paths = [write_csv(tmp_path / f"data{i}.csv", 100) for i in range(2)]
+    updates = []
+
+    progress = load_files(
+        client, paths, "proj.ds.t", chunk_size=500, workers=4,
+        on_progress=lambda p: updates.append(p.bytes),
+    )
+
+    table = client.get_table("proj.ds.t")
+    assert [(f.name, f.field_type) for f in table.schema] == [
+        ("id", "INTEGER"), ("name", "STRING"), ("score", "FLOAT"),
+    ]
+    assert table.num_rows == progress.rows == 200
+    assert progress.chunks == progress.total_chunks > 2
+    assert backend.calls["load_table_from_file"] == progress.chunks
+    assert updates[-1] == progress.total_bytes
+    assert sorted(r["id"] for r in client.list_rows("proj.ds.t"))[-1] == 99
+
+
+def test_load_files_retries_transient_errors(tmp_path):
+    backend = FakeBackend()
+    client = backend.client("proj")
+    path = write_csv(tmp_path / "data.csv", 50)
+    api = make_api()
+    backend.fail("load_table_from_file", exceptions.ServiceUnavailable("busy"), 2)
+
+    progress = load_files(
+        client, [path], "proj.ds.t", schema=parse_schema("id:integer,name,score"),
+        chunk_size=300, api=api,
+    )
+
+    assert api.stats()["load_chunk"]["retries"] == 2
+    assert progress.rows == 50
+    assert progress.bytes == progress.total_bytes
+
+    backend.fail("load_table_from_file", exceptions.BadRequest("bad"), 1)
+    with pytest.raises(exceptions.BadRequest):
+        load_files(client, [path], "proj.ds.t", api=api)
+
+
+def test_load_files_waits_for_job_after_transient_error(tmp_path):
+    backend = FakeBackend()
+    client = backend.client("proj")
+    path = write_csv(tmp_path / "data.csv", 50)
+    api = make_api()
+    backend.fail("result", exceptions.ServiceUnavailable("busy"), 2)
+
+    progress = load_files(
+        client, [path], "proj.ds.t", schema=parse_schema("id:integer,name,score"),
+        chunk_size=300, api=api,
+    )
+
+    # the jobs were looked up by their ids, not submitted again
+    assert backend.calls["load_table_from_file"] == progress.chunks
+    assert client.get_table("proj.ds.t").num_rows == progress.rows == 50
+    assert api.stats()["load_chunk"]["retries"] == 2
+
+
+def test_load_files_resumes_run(tmp_path):
+    backend = FakeBackend()
+    client = backend.client("proj")
+    path = write_csv(tmp_path / "data.csv", 50)
+    schema = parse_schema("id:integer,name,score")
+    first = load_files(
+        client, [path], "proj.ds.t", schema=schema, chunk_size=300, run_id="run1"
+    )
+
+    progress = load_files(
+        client, [path], "proj.ds.t", schema=schema, chunk_size=300, run_id="run1"
+    )
+
+    # every chunk's job of the run is done already
+    assert backend.calls["load_table_from_file"] == first.chunks
+    assert progress.skipped == progress.chunks == first.chunks
+    assert progress.rows == 50
+    assert client.get_table("proj.ds.t").num_rows == 50
+    assert "loaded before" in str(progress)
+
+    load_files(
+        client, [path], "proj.ds.t", schema=schema, chunk_size=300, run_id="run2"
+    )
+    assert client.get_table("proj.ds.t").num_rows == 100
+
+
+def test_load_files_into_regional_dataset(tmp_path):
+    backend = FakeBackend()
+    backend.add_dataset("proj.tokyo", location="asia-northeast1")
+    client = backend.client("proj")
+    path = write_csv(tmp_path / "data.csv", 50)
+    schema = parse_schema("id:integer,name,score")
+    api = make_api()
+    backend.fail("result", exceptions.ServiceUnavailable("busy"), 1)
+
+    first = load_files(
+        client, [path], "proj.tokyo.t", schema=schema, chunk_size=300,
+        run_id="run1", api=api,
+    )
+    progress = load_files(
+        client, [path], "proj.tokyo.t", schema=schema, chunk_size=300,
+        run_id="run1", api=api,
+    )
+
+    # jobs were found in their location, after the error and when resuming
+    assert backend.calls["load_table_from_file"] == first.chunks
+    assert progress.skipped == progress.chunks
+    assert client.get_table("proj.tokyo.t").num_rows == 50
+
+
+def test_load_command(make_bqrepl, tmp_path, capsys):
+    bqrepl, backend = make_bqrepl()
+    (tmp_path / "a.jsonl").write_text('{"id": 1, "ok": true}\n{"id": 2, "ok": false}\n')
+    (tmp_path / "b.jsonl").write_text('{"id": 3, "ok": true}\n')
+
+    bqrepl.execute_command(rf"\load {tmp_path}/*.jsonl ds.t")
+    out = capsys.readouterr().out
+
+    assert "2/2 chunks" in out
+    assert "Loaded 3 rows from 2 file(s) into proj.ds.t" in out
+
+    backend.fail("load_table_from_file", exceptions.BadRequest("bad"), 1)
+    bqrepl.execute_command(rf"\load {tmp_path}/*.jsonl ds.t2")
+    assert "Run the same \\load again to resume" in capsys.readouterr().out
+    bqrepl.execute_command(rf"\load {tmp_path}/*.jsonl ds.t2")
+    out = capsys.readouterr().out
+    assert "Resuming load" in out
+    assert "Loaded 3 rows" in out
+    assert backend.client("proj").get_table("proj.ds.t2").num_rows == 3
+
+    bqrepl.execute_command(r"\load nothing*.csv ds.t")
+    assert "No files matching" in capsys.readouterr().out
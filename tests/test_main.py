@@ -1,3 +1,7 @@
+import os
+import threading
+
+from click import style, unstyle
 from prompt_toolkit.formatted_text import to_formatted_text
 
 from bqrepl.main import BQREPL
@@ -64,7 +68,7 @@ def test_output_formatted():
         "values": {"col1": 5, "col2": 13, "col3longname": 8},
     }
 
-    formatted_rows = bqrepl.format_rows(values, columns, widths, settings)
+    formatted_rows, _ = bqrepl.format_rows(values, columns, widths, settings)
     fr = [to_formatted_text(x) for x in formatted_rows]
     result = ["".join(map(lambda x: x[1], f)) for f in fr]
 
@@ -88,6 +92,7 @@ def test_formmated_output_expanded():
         "format_float": ",.2f",
         "maxwidth": 25,
         "maxrows": 100,
+        "max_expanded_width": 12,
     }
     values = [
         ["1,000", "a", "1,023.20"],
@@ -97,28 +102,181 @@ def test_formmated_output_expanded():
 
     columns = [("col1", "INTEGER"), ("col2", "STRING"), ("col3longname", "FLOAT")]
 
-    widths = {
-        "columns": {"col1": 7, "col2": 6, "col3longname": 12},
-        "values": {"col1": 5, "col2": 24, "col3longname": 8},
-    }
-
-    formatted_rows = bqrepl.format_rows_expanded(values, columns, widths, settings)
+    formatted_rows, w = bqrepl.format_rows_expanded(values, columns, settings)
     fr = [to_formatted_text(x) for x in formatted_rows]
     result = ["".join(map(lambda x: x[1], f)) for f in fr]
 
     expected_result = [
-        "-[ row 0 ]-----------------------------",
-        "col1         | 1,000                   ",
-        "col2         | a                       ",
-        "col3longname | 1,023.20                ",
-        "-[ row 1 ]-----------------------------",
-        "col1         | 900                     ",
-        "col2         | b                       ",
-        "col3longname | 123.10                  ",
-        "-[ row 2 ]-----------------------------",
-        "col1         | null                    ",
-        "col2         | this is a longer output!",
-        "col3longname | 1.00                    ",
+        "-[ row 0 ]-----------------",
+        "col1         | 1,000",
+        "col2         | a",
+        "col3longname | 1,023.20",
+        "-[ row 1 ]-----------------",
+        "col1         | 900",
+        "col2         | b",
+        "col3longname | 123.10",
+        "-[ row 2 ]-----------------",
+        "col1         | null",
+        "col2         | this is a lo",
+        "             | nger output!",
+        "col3longname | 1.00",
     ]
 
     assert result == expected_result
+    assert w == 27
+
+
+def test_expanded_output_streams_records():
+    bqrepl = BQREPL(check_version=False)
+    settings = {"max_expanded_width": 10}
+    columns = [("col1", "INTEGER")]
+    taken = []
+
+    def values():
+        for i in range(1000):
+            taken.append(i)
+            yield [str(i)]
+
+    formatted_rows, _ = bqrepl.format_rows_expanded(values(), columns, settings)
+
+    assert unstyle(next(formatted_rows)) == "-[ row 0 ]-------"
+    assert next(formatted_rows) == "col1 | 0"
+    assert len(taken) == 1
+
+
+def test_expanded_view_column_filter(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl({
+        "proj.ds.t": dict(
+            schema=[("id", "INTEGER"), ("user_name", "STRING"),
+                    ("user_email", "STRING"), ("other", "STRING")],
+            num_rows=2,
+        ),
+    })
+
+    bqrepl.execute_command(r"\x cols=id,user_*")
+    bqrepl.execute_query("select * from ds.t")
+    out = capsys.readouterr().out
+
+    assert "user_email" in out
+    assert "other" not in out
+    assert "2/2" in out
+
+
+def test_output_formatted_color():
+    bqrepl = BQREPL(check_version=False)
+    settings = {"color": "on"}
+    values = [["1,000", None]]
+    columns = [("col1", "INTEGER"), ("col2", "STRING")]
+    widths = {
+        "columns": {"col1": 7, "col2": 6},
+        "values": {"col1": 5, "col2": 4},
+    }
+
+    formatted_rows, w = bqrepl.format_rows(values, columns, widths, settings)
+
+    assert formatted_rows[0] == (
+        style(" row", fg="blue", bold=True) + " | "
+        + style("col1", fg="green") + "    | "
+        + style("col2", fg="green") + "   |"
+    )
+    assert formatted_rows[3] == (
+        style(f" {0:3,d}", fg="blue") + " |   1,000 | "
+        + style("null", fg="bright_red") + "   |"
+    )
+    assert w == 25
+
+
+def test_display_budget_keeps_loading_in_background(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=30)},
+        settings={"display_budget_ms": 300}, page_size=10,
+    )
+    # pages after the first one only arrive once released
+    released = threading.Event()
+    page = backend.page
+
+    def gated_page():
+        if backend.calls["page"]:
+            released.wait(5)
+        page()
+
+    backend.page = gated_page
+
+    bqrepl.execute_query("select id from ds.t")
+    out = capsys.readouterr().out
+    assert "10/30" in out
+    assert "still loading" in out
+    assert bqrepl.pending is not None
+
+    released.set()
+    bqrepl.settings["display_budget_ms"] = 0
+    bqrepl.execute_command(r"\more")
+    out = capsys.readouterr().out
+    assert "30/30" in out
+    assert "still loading" not in out
+    assert bqrepl.pending is None
+
+
+def test_prefetch_stops_at_maxrows(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=1000)},
+        settings={"maxrows": 5, "prefetch_pages": 4}, page_size=10,
+    )
+
+    bqrepl.execute_query("select id from ds.t")
+
+    assert "5/1,000" in capsys.readouterr().out
+    assert backend.calls["page"] == 1
+
+
+def test_expanded_values_wrap_to_terminal(monkeypatch):
+    monkeypatch.setattr(
+        "bqrepl.main.get_terminal_size", lambda: os.terminal_size((30, 24))
+    )
+    bqrepl = BQREPL(check_version=False)
+    settings = {"max_expanded_width": 100, "color": "off"}
+    columns = [("col1", "STRING")]
+
+    formatted_rows, w = bqrepl.format_rows_expanded(
+        iter([["x" * 40]]), columns, settings
+    )
+
+    assert w == 30
+    assert list(formatted_rows) == [
+        "-[ row 0 ]--------------------",
+        "col1 | " + "x" * 23,
+        "     | " + "x" * 17,
+    ]
+
+
+def test_expanded_view_no_matching_columns(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=2)}
+    )
+
+    bqrepl.execute_command(r"\x cols=nope*")
+    bqrepl.execute_query("select * from ds.t")
+
+    out = capsys.readouterr().out
+    assert "No columns match nope*" in out
+    assert "2/2" not in out
+
+
+def test_set_rejects_bad_formats(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        {"proj.ds.t": dict(schema=[("n", "NUMERIC")], num_rows=2)}
+    )
+
+    bqrepl.execute_command(r"\set format_numeric xyz")
+    bqrepl.execute_command(r"\set format_bytes base32")
+    bqrepl.execute_command(r"\set format_float .1f")
+    out = capsys.readouterr().out
+
+    assert "Can't format NUMERIC values with 'xyz'" in out
+    assert "Unknown encoding base32" in out
+    assert bqrepl.settings["format_numeric"] == "default"
+    assert bqrepl.settings["format_bytes"] == "base64"
+    assert bqrepl.settings["format_float"] == ".1f"
+    # queries still show their results
+    bqrepl.execute_query("select * from ds.t")
+    assert "2/2" in capsys.readouterr().out
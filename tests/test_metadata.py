@@ -0,0 +1,154 @@
+import threading
+
+from bqrepl.metadata import MetadataCache, SchemaWatcher, full_id
+
+tables = {
+    f"proj.ds.{name}": dict(schema=[("id", "INTEGER")], num_rows=10)
+    for name in ("a", "b", "c")
+}
+
+# metadata is only cached while the watcher is on
+watched = {"metadata_refresh_interval": 60}
+
+
+def test_full_id():
+    assert full_id("proj", "ds.t$20210101") == "proj.ds.t"
+    assert full_id("proj", "`other.ds.t`") == "other.ds.t"
+    assert full_id("proj", "ds", parts_count=2) == "proj.ds"
+
+
+def test_metadata_is_cached_until_table_changes(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables, settings=watched)
+
+    bqrepl.execute_command(r"\c ds.a")
+    bqrepl.execute_command(r"\c ds.a")
+    assert backend.calls["get_table"] == 1
+
+    backend.alter_table("proj.ds.a", schema=[("id", "INTEGER"), ("added", "STRING")])
+    bqrepl.execute_command(r"\c ds.a")
+    assert "added" not in capsys.readouterr().out
+
+    bqrepl.watcher.check()
+    bqrepl.execute_command(r"\c ds.a")
+    assert "added" in capsys.readouterr().out
+
+
+def test_table_list_invalidated_when_table_added(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables, settings=watched)
+
+    bqrepl.execute_command(r"\t ds")
+    backend.add_table("proj.ds.new_table", [("id", "INTEGER")])
+    bqrepl.watcher.check()
+    bqrepl.execute_command(r"\t ds")
+
+    assert "new_table" in capsys.readouterr().out
+    assert backend.calls["list_tables"] == 2
+
+
+def test_watcher_checks_dataset_in_one_call(make_bqrepl):
+    _, backend = make_bqrepl(tables)
+    client = backend.client(project="proj")
+    cache = MetadataCache()
+    cache.list_tables(client, "ds")
+    for name in ("a", "b", "c"):
+        cache.get_table(client, f"ds.{name}")
+    changed = []
+    settings = {"metadata_refresh_interval": 60, "metadata_refresh_budget": 10}
+    watcher = SchemaWatcher(cache, settings, lambda: client, on_change=changed.append)
+
+    watcher.check()
+    assert changed == []
+
+    backend.alter_table("proj.ds.b", num_rows=20)
+    watcher.check()
+    assert changed == ["proj.ds.b"]
+    assert watcher.checks == 2
+    assert backend.calls["query"] == 2
+    assert backend.calls["get_table"] == 3
+
+
+def test_watcher_keeps_to_call_budget(make_bqrepl):
+    _, backend = make_bqrepl({
+        f"proj.{dataset}.t": dict(schema=[("id", "INTEGER")], num_rows=10)
+        for dataset in ("ds1", "ds2", "ds3")
+    })
+    client = backend.client(project="proj")
+    cache = MetadataCache()
+    for dataset in ("ds1", "ds2", "ds3"):
+        cache.get_table(client, f"{dataset}.t")
+    changed = []
+    settings = {"metadata_refresh_interval": 60, "metadata_refresh_budget": 2}
+    watcher = SchemaWatcher(cache, settings, lambda: client, on_change=changed.append)
+
+    backend.alter_table("proj.ds3.t", num_rows=20)
+    watcher.check()
+    assert watcher.checks == 2
+    assert changed == []
+
+    # budget used up for this minute
+    watcher.check()
+    assert watcher.checks == 2
+
+    watcher._calls.clear()
+    watcher.check()
+    assert changed == ["proj.ds3.t"]
+
+
+def test_ddl_invalidates_cached_table(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables, settings=watched)
+
+    bqrepl.execute_command(r"\c ds.a")
+    bqrepl.execute_query("ALTER TABLE ds.a ADD COLUMN added STRING")
+    bqrepl.execute_command(r"\c ds.a")
+
+    assert "added" in capsys.readouterr().out
+    assert backend.calls["get_table"] == 2
+
+
+def test_watcher_runs_in_background(make_bqrepl):
+    _, backend = make_bqrepl(tables)
+    client = backend.client(project="proj")
+    cache = MetadataCache()
+    cache.get_table(client, "ds.a")
+    settings = {"metadata_refresh_interval": 0.05, "metadata_refresh_budget": 100}
+    changed = threading.Event()
+    watcher = SchemaWatcher(
+        cache, settings, lambda: client, on_change=lambda entity_id: changed.set()
+    )
+
+    watcher.start()
+    backend.drop_table("proj.ds.a")
+    assert changed.wait(5)
+    watcher.stop()
+
+    assert cache.cached() == ({}, {})
+
+
+def test_watcher_jobs_hidden_from_history(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables, settings=watched)
+    bqrepl.execute_command(r"\t ds")
+    bqrepl.execute_query("select id from ds.a")
+    bqrepl.watcher.check()
+    capsys.readouterr()
+
+    bqrepl.execute_command(r"\jobs")
+    out = capsys.readouterr().out
+
+    assert len(backend.jobs) == 2
+    assert "select id from ds.a" in out
+    assert "__TABLES__" not in out
+
+
+def test_watcher_drops_prefetched_previews(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(
+        tables, settings=dict(watched, preview_prefetch=5)
+    )
+    bqrepl.execute_command(r"\t ds")
+    bqrepl.previews.get("proj.ds.a", 1).result()
+
+    backend.alter_table("proj.ds.a", num_rows=12)
+    bqrepl.watcher.check()
+    capsys.readouterr()
+    bqrepl.execute_command(r"\preview ds.a 20")
+
+    assert "12/12" in capsys.readouterr().out
@@ -0,0 +1,92 @@
+import threading
+from itertools import islice
+
+import pytest
+
+from bqrepl.prefetch import PrefetchIterator
+
+
+def test_prefetch_rows_in_order():
+    pages = ([{"n": p * 10 + i} for i in range(10)] for p in range(5))
+    rows = list(PrefetchIterator(pages, depth=2, total_rows=50))
+
+    assert [r["n"] for r in rows] == list(range(50))
+
+
+def test_prefetch_fetches_next_page_while_consuming():
+    fetched = []
+    last_page = threading.Event()
+
+    def pages():
+        for p in range(3):
+            fetched.append(p)
+            if p == 2:
+                last_page.set()
+            yield [p]
+
+    it = PrefetchIterator(pages(), depth=1)
+    assert next(it) == 0
+    # page 1 is buffered, page 2 is fetched and waiting for room in the queue
+    assert last_page.wait(5)
+    assert fetched == [0, 1, 2]
+    assert list(it) == [1, 2]
+
+
+def test_prefetch_is_bounded_and_closes():
+    fetched = []
+    blocked = threading.Event()
+
+    def pages():
+        for p in range(100):
+            fetched.append(p)
+            if p == 3:
+                blocked.set()
+            yield [p]
+
+    it = PrefetchIterator(pages(), depth=2)
+    next(it)
+    # page 0 is being consumed, 1 and 2 are queued, 3 waits for room
+    assert blocked.wait(5)
+    it.close()
+    it._thread.join(5)
+    assert not it._thread.is_alive()
+    assert fetched == [0, 1, 2, 3]
+
+
+def test_prefetch_stops_at_limit():
+    fetched = []
+
+    def pages():
+        for p in range(100):
+            fetched.append(p)
+            yield list(range(p * 10, p * 10 + 10))
+
+    it = PrefetchIterator(pages(), depth=4, limit=5)
+    assert list(islice(it, 5)) == [0, 1, 2, 3, 4]
+    it.close()
+    it._thread.join(5)
+    assert not it._thread.is_alive()
+    assert fetched == [0]
+
+
+def test_prefetch_fetches_past_limit_on_demand():
+    pages = ([p * 10 + i for i in range(10)] for p in range(5))
+
+    it = PrefetchIterator(pages, depth=1, limit=5)
+    assert list(it) == list(range(50))
+
+    it = PrefetchIterator(iter([[1], [2], [3]]), limit=1)
+    assert next(it) == 1
+    it.set_limit(3)
+    assert list(it) == [2, 3]
+
+
+def test_prefetch_reraises_fetch_errors():
+    def pages():
+        yield [1]
+        raise RuntimeError("boom")
+
+    it = PrefetchIterator(pages())
+    assert next(it) == 1
+    with pytest.raises(RuntimeError):
+        next(it)
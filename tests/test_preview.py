@@ -0,0 +1,41 @@
+tables = {
+    "proj.ds.t": dict(
+        schema=[("id", "INTEGER"), ("name", "STRING")],
+        rows=[(i, f"name {i}") for i in range(20)],
+    ),
+}
+
+
+def test_preview_reads_rows_without_query(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables)
+
+    bqrepl.execute_command(r"\preview ds.t$20210101 3 name")
+    out = capsys.readouterr().out
+
+    assert "name 2" in out
+    assert "3/3" in out
+    assert " id " not in out
+    assert backend.calls["query"] == 0
+    assert backend.calls["list_rows"] == 1
+
+
+def test_preview_unknown_column(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables)
+
+    bqrepl.execute_command(r"\preview ds.t nope")
+
+    assert "Unknown columns: nope" in capsys.readouterr().out
+    assert backend.calls["list_rows"] == 0
+
+
+def test_preview_prefetched_after_listing_tables(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables)
+    bqrepl.settings["preview_prefetch"] = 5
+
+    bqrepl.execute_command(r"\t ds")
+    bqrepl.previews.get("proj.ds.t", 5).result()
+    bqrepl.execute_command(r"\preview ds.t 5")
+    out = capsys.readouterr().out
+
+    assert "name 4" in out
+    assert backend.calls["list_rows"] == 1
@@ -0,0 +1,112 @@
+import pytest
+from google.cloud import bigquery
+
+from bqrepl.rewriter import (
+    displayed_columns,
+    parse_select_star,
+    partition_filter,
+    rewrite,
+)
+
+schema = [
+    ("id", "INTEGER"), ("name", "STRING"), ("ts", "TIMESTAMP"),
+    ("a", "STRING"), ("b", "STRING"), ("c", "STRING"), ("d", "STRING"),
+]
+
+tables = {
+    "proj.ds.t": dict(schema=schema, num_rows=100000, partition_field="ts"),
+}
+
+
+@pytest.fixture
+def asking_bqrepl(make_bqrepl):
+    """REPL that answers its own questions with `answer`"""
+
+    def make(answer):
+        bqrepl, backend = make_bqrepl(
+            tables, settings={"select_star_threshold_mb": 1}
+        )
+        bqrepl.ask = lambda message: answer
+        return bqrepl, backend
+
+    return make
+
+
+def test_parse_select_star():
+    assert parse_select_star("select * from `p.ds.t` where x > 1 limit 5;") == (
+        "p.ds.t", "x > 1", " limit 5"
+    )
+    assert parse_select_star("SELECT * FROM ds.t") == ("ds.t", None, None)
+    assert parse_select_star("SELECT id FROM ds.t") is None
+    assert parse_select_star("SELECT * FROM ds.t JOIN ds.u USING (id)") is None
+    assert parse_select_star(
+        "SELECT * FROM ds.t WHERE x IN (SELECT y FROM z LIMIT 3)"
+    ) is None
+    assert parse_select_star("SELECT * FROM ds.t WHERE DATE(ts) = d LIMIT 3") is None
+
+
+def test_rewrite():
+    sql = "select * from ds.t where x > 1 limit 5"
+    assert rewrite(sql, columns=["id", "x"], condition="y = 2") == (
+        "SELECT `id`, `x`\nFROM `ds.t`\nWHERE (x > 1) AND y = 2\nlimit 5"
+    )
+    assert rewrite("select * from ds.t", condition="y = 2") == (
+        "SELECT *\nFROM `ds.t`\nWHERE y = 2"
+    )
+
+
+def test_displayed_columns_fit_width():
+    fields = [bigquery.SchemaField(name, t) for name, t in schema]
+
+    assert displayed_columns(fields, 80, 50) == ["id", "name"]
+    assert displayed_columns(fields, 10, 50) == ["id"]
+    assert len(displayed_columns(fields, 1000, 50)) == len(fields)
+
+
+def test_partition_filter():
+    table = bigquery.Table("p.ds.t", schema=[bigquery.SchemaField("day", "DATE")])
+    assert partition_filter(table) is None
+    table.time_partitioning = bigquery.TimePartitioning()
+    assert partition_filter(table) == "_PARTITIONDATE = CURRENT_DATE()"
+    table.time_partitioning = bigquery.TimePartitioning(field="day")
+    assert partition_filter(table) == "`day` = CURRENT_DATE()"
+
+
+def test_select_star_suggestions(asking_bqrepl, capsys):
+    bqrepl, backend = asking_bqrepl("b")
+
+    bqrepl.execute_query("SELECT * FROM ds.t LIMIT 3")
+    out = capsys.readouterr().out
+
+    assert "SELECT * reads all 7 columns of proj.ds.t" in out
+    assert "[c] only" in out
+    assert "[p] today's partition" in out
+    assert "[b] both" in out
+    assert "DATE(`ts`) = CURRENT_DATE()" in out
+    assert [j.query for j in backend.jobs][-1].startswith("SELECT `id`")
+
+
+def test_select_star_run_as_is(asking_bqrepl, capsys):
+    bqrepl, backend = asking_bqrepl("r")
+
+    bqrepl.execute_query("SELECT * FROM ds.t LIMIT 3")
+
+    assert backend.jobs[-1].query == "SELECT * FROM ds.t LIMIT 3"
+
+
+def test_select_star_abort(asking_bqrepl, capsys):
+    bqrepl, backend = asking_bqrepl("a")
+
+    bqrepl.execute_query("SELECT * FROM ds.t LIMIT 3")
+
+    assert backend.jobs == []
+
+
+def test_select_star_below_threshold(asking_bqrepl, capsys):
+    bqrepl, backend = asking_bqrepl("a")
+    bqrepl.settings["select_star_threshold_mb"] = 1000
+
+    bqrepl.execute_query("SELECT * FROM ds.t LIMIT 3")
+
+    assert "SELECT * reads" not in capsys.readouterr().out
+    assert len(backend.jobs) == 1
@@ -0,0 +1,79 @@
+import pytest
+
+from bqrepl.sinks import sink, sinks
+
+tables = {
+    "proj.ds.t": dict(
+        schema=[("id", "INTEGER"), ("name", "STRING")],
+        rows=[(i, f"name {i}") for i in range(10)],
+    ),
+}
+
+
+def test_terminal_sink(make_bqrepl, capsys):
+    bqrepl, backend = make_bqrepl(tables, page_size=4)
+
+    result = bqrepl.query("SELECT id, name FROM ds.t")
+    result.show()
+
+    out = capsys.readouterr().out
+    assert "name 9" in out
+    assert "10/10" in out
+    assert len(bqrepl.job_stats) == 1
+
+
+def test_rows_are_read_once(make_bqrepl):
+    bqrepl, backend = make_bqrepl(tables, page_size=4)
+    result = bqrepl.query("SELECT id FROM ds.t")
+
+    with pytest.raises(ValueError, match="Unknown sink"):
+        result.to("nope")
+    result.to("terminal")
+    with pytest.raises(ValueError, match="already read"):
+        result.to("terminal")
+
+
+def test_custom_sink(make_bqrepl):
+    bqrepl, backend = make_bqrepl(tables, page_size=4)
+
+    @sink("ids")
+    def ids_sink(handle, offset=0):
+        return [row["id"] + offset for page in handle.rows.pages for row in page]
+
+    try:
+        assert bqrepl.query("SELECT id FROM ds.t").to("ids", offset=1)[-1] == 10
+    finally:
+        del sinks["ids"]
+
+
+def test_missing_pyarrow(make_bqrepl):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        pytest.skip("pyarrow is installed")
+    bqrepl, backend = make_bqrepl(tables, page_size=4)
+
+    with pytest.raises(ImportError, match="pip install pyarrow"):
+        bqrepl.query("SELECT id FROM ds.t").to_arrow()
+
+
+def test_arrow_sinks(make_bqrepl):
+    pytest.importorskip("pyarrow")
+    bqrepl, backend = make_bqrepl(tables, page_size=4)
+
+    table = bqrepl.query("SELECT id, name FROM ds.t").to_arrow()
+    assert table.column_names == ["id", "name"]
+    assert table.num_rows == 10
+
+    batches = list(bqrepl.query("SELECT id FROM ds.t").record_batches())
+    assert [b.num_rows for b in batches] == [4, 4, 2]
+
+
+def test_pandas_sink(make_bqrepl):
+    pytest.importorskip("pandas")
+    bqrepl, backend = make_bqrepl(tables, page_size=4)
+
+    df = bqrepl.query("SELECT id, name FROM ds.t").to_dataframe()
+    assert list(df["id"]) == list(range(10))
@@ -0,0 +1,45 @@
+from bqrepl.stats import format_bytes
+
+tables = {"proj.ds.t": dict(schema=[("id", "INTEGER")], num_rows=1000)}
+
+
+def test_format_bytes():
+    assert format_bytes(None) is None
+    assert format_bytes(512) == "512 B"
+    assert format_bytes(1536) == "1.5 KiB"
+    assert format_bytes(3 * 1024 ** 3) == "3.0 GiB"
+
+
+def test_stats_of_last_query(make_bqrepl, capsys):
+    bqrepl, _ = make_bqrepl(tables)
+    bqrepl.execute_query("select id from ds.t")
+    bqrepl.execute_query("select id from ds.t limit 5")
+    capsys.readouterr()
+
+    bqrepl.execute_command(r"\stats")
+    out = capsys.readouterr().out
+    assert "7.8 KiB" in out
+    assert "S01: Aggregate" in out
+
+    bqrepl.execute_command(r"\stats 5")
+    out = capsys.readouterr().out
+    assert "2/2" in out
+    assert "limit 5" in out
+
+
+def test_jobs_history_pages(make_bqrepl, capsys):
+    bqrepl, _ = make_bqrepl(tables)
+    for i in range(3):
+        bqrepl.execute_query(f"select id from ds.t limit {i + 1}")
+    capsys.readouterr()
+
+    bqrepl.execute_command(r"\jobs history 2")
+    out = capsys.readouterr().out
+    assert "limit 3" in out
+    assert "limit 1" not in out
+    assert "More jobs available" in out
+
+    bqrepl.execute_command(r"\jobs next")
+    out = capsys.readouterr().out
+    assert "limit 1" in out
+    assert bqrepl.jobs_page_token is None